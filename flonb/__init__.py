@@ -1,5 +1,18 @@
-from .task import task_func, set_cache_dir, Dep, DynamicDep  # noqa: F401
+from .task import (  # noqa: F401
+    task_func,
+    set_cache_dir,
+    set_cache_prefetch,
+    Dep,
+    DynamicDep,
+)
 
 __version__ = "0.1.4"  # make sure to also update in ../setup.py
 
-__all__ = ["task_func", "set_cache_dir", "Dep", "DynamicDep", "__version__"]
+__all__ = [
+    "task_func",
+    "set_cache_dir",
+    "set_cache_prefetch",
+    "Dep",
+    "DynamicDep",
+    "__version__",
+]
@@ -0,0 +1,146 @@
+import hashlib
+import os
+import pickle
+import shutil
+from typing import Callable, Hashable
+
+import dask.optimization
+
+from .storage import PackedStorage, _write_all
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+class RunJournal:
+    """Records the progress of a `.compute(checkpoint=True)` run.
+
+    Each finished node that isn't cached with `cache_disk=True` has its result saved
+    to a `PackedStorage` in `dirpath`, then its graph key appended to a `completed`
+    log. A rerun after a crash reads finished nodes back from the journal rather than
+    computing them, along with everything upstream of them. Results that can't be
+    pickled are not saved, and get recomputed on a rerun.
+
+    Runs use the journal inside `with journal:`, which holds a shared lock on it, so
+    that concurrent runs of the same graph can share it. `remove` leaves the journal
+    to the last of them to finish.
+    """
+
+    category = "results"
+
+    def __init__(self, dirpath: str):
+        self.dirpath = dirpath
+        self.completed_fpath = os.path.join(dirpath, "completed")
+        self.storage = PackedStorage(dirpath)
+        self._lock_fd = None
+
+    def __enter__(self):
+        lock_fpath = os.path.join(self.dirpath, "lock")
+        while fcntl is not None:
+            os.makedirs(self.dirpath, exist_ok=True)
+            fd = os.open(lock_fpath, os.O_RDWR | os.O_CREAT, 0o644)
+            fcntl.flock(fd, fcntl.LOCK_SH)
+            try:
+                if os.fstat(fd).st_ino == os.stat(lock_fpath).st_ino:
+                    self._lock_fd = fd
+                    break
+            except FileNotFoundError:
+                pass
+            os.close(fd)  # removed by another run while waiting for the lock
+        return self
+
+    def __exit__(self, *exc_info):
+        if self._lock_fd is not None or fcntl is None:
+            if not os.path.exists(self.completed_fpath):
+                self.remove()  # nothing to resume from
+        self._unlock()
+
+    def _unlock(self):
+        if self._lock_fd is not None:
+            os.close(self._lock_fd)
+            self._lock_fd = None
+
+    def __repr__(self):
+        return f"flonb.journal.RunJournal({self.dirpath!r})"
+
+    @classmethod
+    def for_run(cls, base_dirpath: str, key: Hashable) -> "RunJournal":
+        """Journal of the run computing graph key `key`, in the cache dir"""
+        name = _hash_key(key)
+        return cls(os.path.join(base_dirpath, ".flonb", "journals", name))
+
+    def completed(self) -> set:
+        try:
+            with open(self.completed_fpath, "r") as fd:
+                # a crash mid-write can leave the last line incomplete
+                return {line.split("\t")[0] for line in fd if line.endswith("\n")}
+        except FileNotFoundError:
+            return set()
+
+    def record(self, key: Hashable, result: object):
+        name = _hash_key(key)
+        try:
+            data = pickle.dumps(result)
+        except Exception:
+            return
+        self.storage.write(self.category, name, data)
+        os.makedirs(self.dirpath, exist_ok=True)
+        fd = os.open(self.completed_fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT)
+        try:
+            _write_all(fd, f"{name}\t{key}\n".encode())
+        finally:
+            os.close(fd)
+
+    def read(self, key: Hashable) -> object:
+        return pickle.loads(self.storage.read(self.category, _hash_key(key)))
+
+    def resume(self, graph: dict, key: Hashable) -> dict:
+        """Swaps finished nodes for journal reads, and records the rest as they finish"""
+        completed = self.completed()
+        resumed_graph = {}
+        for k, v in graph.items():
+            if not (isinstance(v, tuple) and callable(v[0])):
+                resumed_graph[k] = v
+            elif _hash_key(k) in completed:
+                resumed_graph[k] = (self._get_read_func(k),)
+            elif getattr(v[0], "_flonb_cached", False):
+                # already saved in the cache
+                resumed_graph[k] = v
+            else:
+                resumed_graph[k] = (self._get_record_func(k, v[0]), *v[1:])
+        # drop everything only needed by finished nodes
+        resumed_graph, _ = dask.optimization.cull(resumed_graph, key)
+        return resumed_graph
+
+    def _get_read_func(self, key: Hashable) -> Callable:
+        def read_journal(*args):
+            return self.read(key)
+
+        return read_journal
+
+    def _get_record_func(self, key: Hashable, func: Callable) -> Callable:
+        def record_in_journal(*args):
+            result = func(*args)
+            self.record(key, result)
+            return result
+
+        return record_in_journal
+
+    def remove(self):
+        """Deletes the journal, unless another run is still using it.
+        Either way, this run is done with it.
+        """
+        if self._lock_fd is not None:
+            try:
+                fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                self._unlock()
+                return
+        shutil.rmtree(self.dirpath, ignore_errors=True)
+        self._unlock()
+
+
+def _hash_key(key: Hashable) -> str:
+    return hashlib.md5(str(key).encode()).hexdigest()
@@ -0,0 +1,110 @@
+import concurrent.futures
+import pickle
+import threading
+from typing import Callable, Dict, Hashable
+
+
+class CachePrefetcher:
+    """Reads cached results on a thread pool, ahead of the scheduler needing them.
+
+    Reads start as soon as the prefetcher is entered as a context manager.
+    `.get_func(key)` gives a graph function that returns the prefetched result,
+    or reads it on the spot if the prefetcher hasn't got to it yet.
+
+    At most `max_bytes` of read-but-not-yet-consumed results are held at a time
+    (measured as their pickled size). The cap is checked before each read starts,
+    so it can be overshot by up to `max_workers` results.
+    """
+
+    max_workers: int = 8
+    max_bytes: int = 256 * 1024 * 1024
+
+    def __init__(self, caches: Dict[Hashable, object]):
+        self.caches = caches
+        self._cond = threading.Condition()
+        self._futures: Dict[Hashable, concurrent.futures.Future] = {}
+        self._claimed = set()
+        self._held_bytes = 0
+        self._n_reading = 0
+        self._closed = False
+        self._executor = None
+        self._feeder = None
+
+    @classmethod
+    def configure(cls, max_workers: int, max_bytes: int):
+        cls.max_workers = max_workers
+        cls.max_bytes = max_bytes
+
+    def __enter__(self):
+        if self.max_workers > 0 and self.caches:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.max_workers, thread_name_prefix="flonb-prefetch"
+            )
+            self._feeder = threading.Thread(target=self._feed, daemon=True)
+            self._feeder.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._feeder is not None:
+            self._feeder.join()
+        for future in self._futures.values():
+            future.cancel()
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+        self._futures.clear()
+
+    def _feed(self):
+        for key, cache in self.caches.items():
+            with self._cond:
+                while not self._closed and (
+                    self._held_bytes >= self.max_bytes
+                    or self._n_reading >= self.max_workers
+                ):
+                    self._cond.wait()
+                if self._closed:
+                    return
+                if key in self._claimed:
+                    continue  # the scheduler got there first
+                self._claimed.add(key)
+                self._n_reading += 1
+                self._futures[key] = self._executor.submit(self._read, cache)
+
+    def _read(self, cache):
+        n_bytes = 0
+        try:
+            data = cache.read_bytes()
+            n_bytes = len(data)
+            return pickle.loads(data), n_bytes
+        finally:
+            with self._cond:
+                self._n_reading -= 1
+                self._held_bytes += n_bytes
+                self._cond.notify_all()
+
+    def get(self, key: Hashable) -> object:
+        with self._cond:
+            if key not in self._claimed:
+                self._claimed.add(key)
+                future = None
+            else:
+                future = self._futures[key]
+        if future is None:
+            return self.caches[key].read()
+        try:
+            result, n_bytes = future.result()
+        finally:
+            with self._cond:
+                del self._futures[key]
+        with self._cond:
+            self._held_bytes -= n_bytes
+            self._cond.notify_all()
+        return result
+
+    def get_func(self, key: Hashable) -> Callable:
+        def get_prefetched_data(*args):
+            return self.get(key)
+
+        return get_prefetched_data
@@ -0,0 +1,389 @@
+"""Critical-path scheduling, using the recorded runtimes of past tasks.
+
+Every task run by `flonb` has its runtime recorded in the cache dir (when one is
+set), keyed by its graph key: the task name and the options identifying it.
+Runtimes are written in batches, at the end of each run, and recording them is
+best-effort: failing to write them only logs a warning.
+`flonb.scheduler.get` uses these to start the tasks on the longest remaining path
+through the graph first, so that slow tasks deep in the graph don't end up as the
+tail of the run.
+"""
+
+import collections
+import concurrent.futures
+import heapq
+import logging
+import os
+import statistics
+import threading
+import time
+from typing import Dict, Hashable, List, NamedTuple, Optional, Sequence, Tuple
+
+import dask.core
+import dask.optimization
+
+from .journal import _hash_key
+from .storage import _atomic_write, _write_all
+
+_logger = logging.getLogger("flonb")
+
+
+class RuntimeHistory:
+    """Append-only log of task runtimes, at `<cache dir>/.flonb/runtimes`.
+
+    The expected runtime of a graph key is the mean of its last `n_recent` runs.
+    Keys that have never run are assumed to take as long as other runs of the same
+    task, or failing that, `default_runtime` seconds.
+
+    Once the log grows past `max_bytes` it is compacted to the last `n_recent` runs
+    of each key, dropping the oldest keys if that isn't enough.
+    """
+
+    n_recent = 5
+    max_bytes = 1024 * 1024
+
+    def __init__(self, base_dirpath: str, default_runtime: float = 0.0):
+        self.fpath = os.path.join(base_dirpath, ".flonb", "runtimes")
+        self.default_runtime = default_runtime
+        self._by_key: Dict[str, collections.deque] = {}
+        self._by_task: Dict[str, collections.deque] = {}
+        self._pos = 0
+        self._inode = None
+
+    def __repr__(self):
+        return f"flonb.scheduler.RuntimeHistory({self.fpath!r})"
+
+    def record(self, key: Hashable, seconds: float):
+        self.record_many([(key, seconds)])
+
+    def record_many(self, runs: Sequence[Tuple[Hashable, float]]):
+        """Appends `(key, seconds)` runs to the log in one write"""
+        data = "".join(
+            f"{_hash_key(key)}\t{key[0]}\t{seconds:.6f}\n" for key, seconds in runs
+        ).encode()
+        os.makedirs(os.path.dirname(self.fpath), exist_ok=True)
+        fd = os.open(self.fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            _write_all(fd, data)
+            size = os.fstat(fd).st_size
+        finally:
+            os.close(fd)
+        if size > self.max_bytes:
+            self.compact()
+
+    def compact(self):
+        """Rewrites the log with the last `n_recent` runs of each key, in at most
+        half of `max_bytes`. Runs recorded by other processes while compacting may be
+        lost, which only costs a little accuracy.
+        """
+        try:
+            with open(self.fpath, "rb") as fd:
+                lines = [line for line in fd if line.endswith(b"\n")]
+        except FileNotFoundError:
+            return
+        n_kept = collections.Counter()
+        kept = []
+        size = 0
+        for line in reversed(lines):
+            key_hash = line.split(b"\t", 1)[0]
+            if n_kept[key_hash] == self.n_recent:
+                continue
+            if size + len(line) > self.max_bytes // 2:
+                break
+            n_kept[key_hash] += 1
+            kept.append(line)
+            size += len(line)
+        _atomic_write(self.fpath, b"".join(reversed(kept)))
+
+    def _refresh(self):
+        try:
+            fd = open(self.fpath, "rb")
+        except OSError:  # not recorded yet, or can't be
+            return
+        with fd:
+            stat = os.fstat(fd.fileno())
+            if stat.st_ino != self._inode or stat.st_size < self._pos:
+                # compacted since last read
+                self._by_key.clear()
+                self._by_task.clear()
+                self._pos = 0
+                self._inode = stat.st_ino
+            fd.seek(self._pos)
+            for line in fd:
+                if not line.endswith(b"\n"):
+                    break  # still being written
+                self._pos += len(line)
+                key_hash, task_name, seconds = line.decode().rstrip("\n").split("\t")
+                for runtimes, k in [
+                    (self._by_key, key_hash),
+                    (self._by_task, task_name),
+                ]:
+                    if k not in runtimes:
+                        runtimes[k] = collections.deque(maxlen=self.n_recent)
+                    runtimes[k].append(float(seconds))
+
+    def estimate(self, key: Hashable) -> float:
+        self._refresh()
+        runtimes = self._by_key.get(_hash_key(key)) or self._by_task.get(key[0])
+        if not runtimes:
+            return self.default_runtime
+        return statistics.mean(runtimes)
+
+    def has_runtime(self, key: Hashable) -> bool:
+        self._refresh()
+        return _hash_key(key) in self._by_key
+
+
+class _PendingRuntimes:
+    """Runtimes of graph nodes, buffered to be written to their `RuntimeHistory` at
+    the end of a run. They are also written every `max_pending` runs or `max_age`
+    seconds, for the worker processes of multiprocessing schedulers, which can still
+    exit with their last few runtimes unwritten.
+    """
+
+    max_pending = 1000
+    max_age = 1.0
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._runs: Dict[str, list] = {}  # by cache dir
+        self._n_runs = 0
+        self._flushed_at = time.monotonic()
+
+    def add(self, base_dirpath: str, key: Hashable, seconds: float):
+        with self._lock:
+            self._runs.setdefault(base_dirpath, []).append((key, seconds))
+            self._n_runs += 1
+            is_due = (
+                self._n_runs >= self.max_pending
+                or time.monotonic() - self._flushed_at >= self.max_age
+            )
+        if is_due:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            runs, self._runs = self._runs, {}
+            self._n_runs = 0
+            self._flushed_at = time.monotonic()
+        for base_dirpath, dir_runs in runs.items():
+            history = RuntimeHistory(base_dirpath)
+            try:
+                history.record_many(dir_runs)
+            except OSError as e:
+                _logger.warning(f"Couldn't record task runtimes in {history}: {e}")
+
+
+_pending_runtimes = _PendingRuntimes()
+
+
+def _record_runtime(base_dirpath: str, key: Hashable, seconds: float):
+    _pending_runtimes.add(base_dirpath, key, seconds)
+
+
+def _flush_runtimes():
+    _pending_runtimes.flush()
+
+
+class NodeEstimate(NamedTuple):
+    key: Hashable
+    cache_hit: bool
+    runtime: float
+    critical: bool
+
+
+class Explanation:
+    """Dry-run summary of a task graph: see `flonb.Task.explain`.
+
+    `serial_runtime` is the expected runtime of `.compute()`, which runs one node at
+    a time. `makespan(num_workers)` is that of `get` on `num_workers` threads.
+    """
+
+    def __init__(self, dsk: dict, key: Hashable, history: Optional[RuntimeHistory]):
+        self.key = key
+        self._dsk = dsk
+        self._costs = costs = estimate_costs(dsk, history)
+        critical = set(critical_path(dsk, costs))
+        self.nodes = [
+            NodeEstimate(
+                k,
+                getattr(v[0], "_flonb_cache_read", False),
+                costs[k],
+                k in critical,
+            )
+            for k, v in ((k, dsk[k]) for k in dask.core.toposort(dsk))
+            if dask.core.istask(v)
+        ]
+        self.serial_runtime = sum(costs.values())
+        self.critical_path_runtime = sum(costs[k] for k in critical)
+
+    def makespan(self, num_workers: int = None) -> float:
+        """Expected runtime of `get` on `num_workers` threads (default: one per CPU)"""
+        return estimate_makespan(self._dsk, self._costs, _default_workers(num_workers))
+
+    def __repr__(self):
+        nodes = "\n".join(
+            f"  {'cache' if n.cache_hit else 'run':5}  {'*' if n.critical else ' '}  "
+            f"{n.runtime:9.3f}s  {n.key}"
+            for n in self.nodes
+        )
+        num_workers = _default_workers(None)
+        return (
+            f"flonb.Explanation     {self.key}\n"
+            f"estimated runtime:    {self.serial_runtime:.3f}s with `.compute()`\n"
+            f"estimated makespan:   {self.makespan(num_workers):.3f}s "
+            f"with `flonb.scheduler.get(num_workers={num_workers})`\n"
+            f"critical path (*):    {self.critical_path_runtime:.3f}s\n"
+            f"nodes:\n{nodes}"
+        )
+
+
+def estimate_costs(
+    dsk: dict, history: Optional[RuntimeHistory]
+) -> Dict[Hashable, float]:
+    """Expected runtime of each node. Options and cache reads are taken as free."""
+    costs = {}
+    for k, v in dsk.items():
+        if (
+            history is None
+            or not dask.core.istask(v)
+            or getattr(v[0], "_flonb_cache_read", False)
+        ):
+            costs[k] = 0.0
+        else:
+            costs[k] = history.estimate(k)
+    return costs
+
+
+def bottom_levels(dsk: dict, costs: Dict[Hashable, float]) -> Dict[Hashable, float]:
+    """Length of the most expensive path from each node to the end of the graph"""
+    _, dependents = dask.core.get_deps(dsk)
+    levels = {}
+    for k in reversed(dask.core.toposort(dsk)):
+        levels[k] = costs[k] + max((levels[d] for d in dependents[k]), default=0.0)
+    return levels
+
+
+def critical_path(dsk: dict, costs: Dict[Hashable, float]) -> List[Hashable]:
+    dependencies, dependents = dask.core.get_deps(dsk)
+    levels = bottom_levels(dsk, costs)
+    path = []
+    candidates = [k for k in dsk if not dependencies[k]]
+    while candidates:
+        k = max(candidates, key=lambda c: levels[c])
+        path.append(k)
+        candidates = list(dependents[k])
+    return path
+
+
+def estimate_makespan(
+    dsk: dict, costs: Dict[Hashable, float], num_workers: int
+) -> float:
+    """Simulates `get` on `num_workers` workers, with every node taking its cost"""
+    dependencies, dependents = dask.core.get_deps(dsk)
+    levels = bottom_levels(dsk, costs)
+    n_waiting = {k: len(dependencies[k]) for k in dsk}
+    order = {k: i for i, k in enumerate(dsk)}
+    ready = [(-levels[k], -costs[k], order[k], k) for k in dsk if not n_waiting[k]]
+    heapq.heapify(ready)
+    running = []  # (finish time, index, key)
+    now = 0.0
+    while ready or running:
+        while ready and len(running) < num_workers:
+            _, _, i, k = heapq.heappop(ready)
+            heapq.heappush(running, (now + costs[k], i, k))
+        now, _, k = heapq.heappop(running)
+        for d in dependents[k]:
+            n_waiting[d] -= 1
+            if not n_waiting[d]:
+                heapq.heappush(ready, (-levels[d], -costs[d], order[d], d))
+    return now
+
+
+def get(
+    dsk: dict,
+    keys,
+    num_workers: int = None,
+    history: Optional[RuntimeHistory] = None,
+):
+    """Threaded get function that runs the tasks on the critical path first.
+
+    Ready tasks are started in order of the expected runtime of the longest path
+    from them to the end of the graph, then of their own expected runtime, using
+    the runtimes recorded in `history`. `history` defaults to that of the cache dir.
+    Threads suit tasks that release the GIL, e.g. I/O or numpy-heavy work.
+    """
+    from .task import Cache  # avoid a circular import
+
+    keys_list = keys if isinstance(keys, list) else [keys]
+    dsk, dependencies = dask.optimization.cull(dsk, list(dask.core.flatten(keys_list)))
+    if history is None and Cache._base_dirpath is not None:
+        history = RuntimeHistory(Cache._base_dirpath)
+    costs = estimate_costs(dsk, history)
+    levels = bottom_levels(dsk, costs)
+    dependents = dask.core.reverse_dict(dependencies)
+
+    keep = set(dask.core.flatten(keys_list))
+    n_waiting = {k: len(dependencies[k]) for k in dsk}
+    n_unfinished_dependents = {k: len(dependents[k]) for k in dsk}
+    results = {}
+    order = {k: i for i, k in enumerate(dsk)}
+    ready = [(-levels[k], -costs[k], order[k], k) for k in dsk if not n_waiting[k]]
+    heapq.heapify(ready)
+
+    def finish(k, result):
+        results[k] = result
+        for d in dependents[k]:
+            n_waiting[d] -= 1
+            if not n_waiting[d]:
+                heapq.heappush(ready, (-levels[d], -costs[d], order[d], d))
+        for dep in dependencies[k]:
+            n_unfinished_dependents[dep] -= 1
+            if not n_unfinished_dependents[dep] and dep not in keep:
+                del results[dep]
+
+    num_workers = _default_workers(num_workers)
+    try:
+        with concurrent.futures.ThreadPoolExecutor(
+            num_workers, thread_name_prefix="flonb-scheduler"
+        ) as executor:
+            running = {}
+            try:
+                while ready or running:
+                    while ready and len(running) < num_workers:
+                        _, _, _, k = heapq.heappop(ready)
+                        if dask.core.istask(dsk[k]):
+                            func, *args = dsk[k]
+                            args = [_resolve(arg, dsk, results) for arg in args]
+                            running[executor.submit(func, *args)] = k
+                        else:
+                            finish(k, _resolve(dsk[k], dsk, results))
+                    if not running:
+                        continue
+                    done, _ = concurrent.futures.wait(
+                        running, return_when=concurrent.futures.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        finish(running.pop(future), future.result())
+            finally:
+                for future in running:
+                    future.cancel()
+    finally:
+        _flush_runtimes()
+    return _resolve(keys, dsk, results)
+
+
+def _default_workers(num_workers: Optional[int]) -> int:
+    return num_workers or os.cpu_count() or 1
+
+
+def _resolve(arg, dsk: dict, results: dict):
+    """Substitutes graph keys in (nested lists of) task arguments with their results"""
+    if isinstance(arg, list):
+        return [_resolve(a, dsk, results) for a in arg]
+    try:
+        if arg in dsk:
+            return results[arg]
+    except TypeError:  # unhashable
+        pass
+    return arg
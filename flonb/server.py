@@ -0,0 +1,284 @@
+"""Long-running worker pool, to skip interpreter startup and imports on every run.
+
+Start a server on a Unix socket, preloading the modules that define your tasks:
+
+    $ python -m flonb.server /tmp/flonb.sock --cache-dir /tmp/cache --preload mypipeline
+
+then compute tasks through it from any other process:
+
+    client = flonb.server.Client("/tmp/flonb.sock")
+    client.compute("mypipeline:word_count", normalise=False, word="badger")
+
+The server keeps task modules imported, and the cache backend loaded (e.g. the
+segment indexes of the packed layout), between requests. Results are not kept in
+memory: every request reads cache hits from the cache dir. Requests from different
+clients run concurrently, and a graph node that one request is already computing is
+waited on, not computed again, by any other request that needs it.
+
+Requests and results are pickled, so only expose the socket to trusted users.
+"""
+
+import argparse
+import concurrent.futures
+import copy
+import functools
+import importlib
+import os
+import pickle
+import socket
+import socketserver
+import struct
+import threading
+from typing import Callable, Dict, Hashable, Sequence, Union
+
+import dask.core
+
+from .task import Task, _compute_graph, set_cache_dir
+
+_HEADER = struct.Struct("!Q")
+
+
+class ServerStats:
+    """Request counters of a `WorkerPoolServer`"""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.nodes_run = 0
+        self.nodes_deduped = 0
+
+    def __repr__(self):
+        return (
+            f"flonb.server.ServerStats\n"
+            f"requests:       {self.requests} ({self.errors} failed)\n"
+            f"nodes run:      {self.nodes_run}\n"
+            f"nodes deduped:  {self.nodes_deduped}"
+        )
+
+
+class _InflightNodes:
+    """Shares graph nodes being computed by one request with every other request.
+
+    Waiting requests get a deep copy of the result, so a task mutating its input
+    can't change it under another request. Results that can't be copied are shared.
+    """
+
+    def __init__(self, stats: ServerStats):
+        self.stats = stats
+        self._lock = threading.Lock()
+        self._futures: Dict[Hashable, concurrent.futures.Future] = {}
+
+    def wrap_graph(self, graph: dict) -> dict:
+        return {
+            k: (
+                (self._wrap(k, v[0]), *v[1:])
+                if dask.core.istask(v) and not getattr(v[0], "_flonb_cache_read", False)
+                else v
+            )
+            for k, v in graph.items()
+        }
+
+    def _wrap(self, key: Hashable, func: Callable) -> Callable:
+        # graph keys only name tasks, which several preloaded modules may share
+        key = (
+            getattr(func, "__module__", None),
+            getattr(func, "__qualname__", None),
+            key,
+        )
+
+        @functools.wraps(func)
+        def run_once(*args):
+            with self._lock:
+                future = self._futures.get(key)
+                is_owner = future is None
+                if is_owner:
+                    future = self._futures[key] = concurrent.futures.Future()
+                    self.stats.nodes_run += 1
+                else:
+                    self.stats.nodes_deduped += 1
+            if not is_owner:
+                result = future.result()
+                try:
+                    return copy.deepcopy(result)
+                except (TypeError, copy.Error):
+                    return result
+            try:
+                result = func(*args)
+            except BaseException as e:
+                future.set_exception(e)
+                raise
+            else:
+                future.set_result(result)
+                return result
+            finally:
+                with self._lock:
+                    del self._futures[key]
+
+        return run_once
+
+
+class WorkerPoolServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Computes `(task, options)` requests from `Client`s, on up to `max_workers`
+    threads at a time. Modules in `preload` are imported up front.
+    """
+
+    daemon_threads = True
+
+    def __init__(
+        self, socket_path: str, preload: Sequence[str] = (), max_workers: int = None
+    ):
+        if os.path.exists(socket_path):
+            _remove_stale_socket(socket_path)
+        for module_name in preload:
+            importlib.import_module(module_name)
+        self.socket_path = socket_path
+        self.stats = ServerStats()
+        self._stats_lock = threading.Lock()
+        self._inflight = _InflightNodes(self.stats)
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers, thread_name_prefix="flonb-server"
+        )
+        super().__init__(socket_path, _RequestHandler)
+        os.chmod(socket_path, 0o600)
+
+    def server_close(self):
+        super().server_close()
+        self._executor.shutdown(wait=False)
+        if os.path.exists(self.socket_path):
+            os.remove(self.socket_path)
+
+    def compute(self, task_ref: str, presupplied_options: dict, options: dict):
+        checkpoint = options.pop("checkpoint", False)
+        task = _resolve_task(task_ref)
+        if presupplied_options:
+            task = task.partial(**presupplied_options)
+        graph, key = task._graph_and_key_to_compute(**options)
+        graph = self._inflight.wrap_graph(graph)
+        return self._executor.submit(
+            _compute_graph, graph, key, checkpoint=checkpoint
+        ).result()
+
+
+class _RequestHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        try:
+            data = _recv_message(self.request)
+        except ConnectionError:
+            return  # the client hung up, e.g. after checking that the server is up
+        with self.server._stats_lock:
+            self.server.stats.requests += 1
+        try:
+            task_ref, presupplied_options, options = pickle.loads(data)
+            result = self.server.compute(task_ref, presupplied_options, options)
+        except Exception as e:
+            with self.server._stats_lock:
+                self.server.stats.errors += 1
+            response = ("error", e)
+        else:
+            response = ("ok", result)
+        try:
+            _send(self.request, response)
+        except (pickle.PicklingError, AttributeError, TypeError) as e:
+            _send(self.request, ("error", RuntimeError(f"Can't send result: {e!r}")))
+
+
+class Client:
+    """Sends tasks to a `WorkerPoolServer` listening on `socket_path`"""
+
+    def __init__(self, socket_path: str, timeout: float = None):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"flonb.server.Client({self.socket_path!r})"
+
+    def compute(self, task: Union[Task, str], **options):
+        """Like `task.compute(**options)`, but run by the server.
+
+        `task` is a `flonb.Task` defined at the top level of a module, or a
+        `"module:task_name"` reference to one.
+        """
+        if isinstance(task, Task):
+            task_ref = f"{task.__module__}:{task.__qualname__}"
+            presupplied_options = task.presupplied_options
+        else:
+            task_ref = task
+            presupplied_options = {}
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.settimeout(self.timeout)
+            sock.connect(self.socket_path)
+            _send(sock, (task_ref, presupplied_options, options))
+            status, result = _recv(sock)
+        if status == "error":
+            raise result
+        return result
+
+
+def _remove_stale_socket(socket_path: str):
+    """Removes a socket left behind by a server that died, but not a live one"""
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        try:
+            sock.connect(socket_path)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+            return
+    raise OSError(f"A server is already listening on '{socket_path}'.")
+
+
+def _resolve_task(task_ref: str) -> Task:
+    module_name, _, task_name = task_ref.partition(":")
+    obj = importlib.import_module(module_name)
+    for attr in task_name.split("."):
+        obj = getattr(obj, attr)
+    if not isinstance(obj, Task):
+        raise ValueError(f"'{task_ref}' is not a `flonb.Task`.")
+    return obj
+
+
+def _send(sock: socket.socket, obj: object):
+    data = pickle.dumps(obj, protocol=pickle.HIGHEST_PROTOCOL)
+    sock.sendall(_HEADER.pack(len(data)) + data)
+
+
+def _recv(sock: socket.socket) -> object:
+    return pickle.loads(_recv_message(sock))
+
+
+def _recv_message(sock: socket.socket) -> bytes:
+    (size,) = _HEADER.unpack(_recv_exactly(sock, _HEADER.size))
+    return _recv_exactly(sock, size)
+
+
+def _recv_exactly(sock: socket.socket, size: int) -> bytes:
+    buf = bytearray()
+    while len(buf) < size:
+        chunk = sock.recv(min(size - len(buf), 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed mid-message.")
+        buf += chunk
+    return bytes(buf)
+
+
+def main(argv: Sequence[str] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m flonb.server", description=__doc__.split("\n")[0]
+    )
+    parser.add_argument("socket_path")
+    parser.add_argument("--cache-dir")
+    parser.add_argument("--layout", default="flat", choices=["flat", "packed"])
+    parser.add_argument("--preload", nargs="*", default=[])
+    parser.add_argument("--max-workers", type=int)
+    args = parser.parse_args(argv)
+
+    if args.cache_dir is not None:
+        set_cache_dir(args.cache_dir, layout=args.layout)
+    with WorkerPoolServer(args.socket_path, args.preload, args.max_workers) as server:
+        print(f"flonb server listening on {args.socket_path}", flush=True)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+"""Multiprocessing scheduler that passes large results through shared memory.
+
+`flonb.shared_memory.get` is a drop-in replacement for `dask.multiprocessing.get`.
+Results that pickle to at least `threshold` bytes are written by the worker that
+computed them into a `multiprocessing.shared_memory` block. Only a small handle to
+the block goes back to the parent process and on to the workers that use the
+result, which read it straight out of shared memory. Each block is freed once the
+last task using it has finished, and every block of a run is freed when it ends,
+even if a task failed. Results are pickled with cloudpickle, as dask does, and
+smaller results are passed on already pickled, so they're only pickled once.
+"""
+
+import functools
+import pickle
+import uuid
+from multiprocessing import shared_memory
+from typing import Dict, Hashable, Optional
+
+import cloudpickle
+import dask.core
+import dask.multiprocessing
+import dask.optimization
+from dask.callbacks import Callback
+
+from .task import Cache
+
+
+class SharedResult:
+    """Handle to a pickled result in a shared memory block"""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def __repr__(self):
+        return f"flonb.shared_memory.SharedResult({self.name!r}, size={self.size})"
+
+    def load(self) -> object:
+        shm = shared_memory.SharedMemory(name=self.name)
+        try:
+            return pickle.loads(shm.buf[: self.size])
+        finally:
+            shm.close()
+
+    def release(self):
+        try:
+            shm = shared_memory.SharedMemory(name=self.name)
+        except FileNotFoundError:
+            return
+        shm.close()
+        shm.unlink()
+
+
+class _PickledResult:
+    """Result pickled by the worker that computed it"""
+
+    def __init__(self, data: bytes):
+        self.data = data
+
+    def load(self) -> object:
+        return cloudpickle.loads(self.data)
+
+
+class _SharedMemoryTask:
+    """Graph function wrapper that loads shared arguments, and shares large results"""
+
+    def __init__(self, func, threshold: int, shm_name: str):
+        self.func = func
+        self.threshold = threshold
+        self.shm_name = shm_name
+
+    def __call__(self, *args):
+        result = self.func(*[_load_shared(arg) for arg in args])
+        try:
+            data = cloudpickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+        except Exception:
+            return result  # for dask to report, as it would without shared memory
+        if len(data) < self.threshold:
+            return _PickledResult(data)
+        shm = shared_memory.SharedMemory(
+            name=self.shm_name, create=True, size=len(data)
+        )
+        try:
+            shm.buf[: len(data)] = data
+        finally:
+            shm.close()
+        return SharedResult(shm.name, len(data))
+
+
+def _load_shared(arg):
+    if isinstance(arg, (SharedResult, _PickledResult)):
+        return arg.load()
+    elif isinstance(arg, list):
+        return [_load_shared(a) for a in arg]
+    return arg
+
+
+class _SharedResultReleaser:
+    """Frees each shared result once every task depending on it has finished"""
+
+    def __init__(self, dsk: dict, keys: list):
+        self.keep = set(dask.core.flatten(keys))
+        self.dependencies = {k: dask.core.get_dependencies(dsk, k) for k in dsk}
+        self.n_dependents: Dict[Hashable, int] = {k: 0 for k in dsk}
+        for deps in self.dependencies.values():
+            for dep in deps:
+                self.n_dependents[dep] += 1
+        self.shared: Dict[Hashable, SharedResult] = {}
+
+    def _maybe_release(self, key):
+        if self.n_dependents[key] == 0 and key not in self.keep and key in self.shared:
+            self.shared.pop(key).release()
+
+    def posttask(self, key, result, dsk, state, worker_id):
+        if isinstance(result, SharedResult):
+            self.shared[key] = result
+        for dep in self.dependencies[key]:
+            self.n_dependents[dep] -= 1
+            self._maybe_release(dep)
+        self._maybe_release(key)
+
+    def release_all(self):
+        for shared in self.shared.values():
+            shared.release()
+        self.shared.clear()
+
+
+def _init_worker(base_dirpath: Optional[str], storage):
+    # class attributes aren't inherited by spawned worker processes
+    if base_dirpath is not None:
+        Cache.set_dir(base_dirpath, storage=storage)
+
+
+def get(
+    dsk: dict, keys, num_workers: int = None, threshold: int = 1024 * 1024, **kwargs
+):
+    """Multiprocessing get function, passing large results through shared memory.
+
+    Takes the same arguments as `dask.multiprocessing.get`, plus `threshold`:
+    the pickled size in bytes from which results are put in shared memory.
+    Graph optimization is turned off, so every result stays addressable.
+    """
+    keys_list = keys if isinstance(keys, list) else [keys]
+    dsk, _ = dask.optimization.cull(dsk, keys_list)
+    releaser = _SharedResultReleaser(dsk, keys_list)
+    # blocks are named after the run, so that all of them can be found to free at
+    # the end: results finishing after a task failed never reach the releaser
+    run_id = uuid.uuid4().hex[:12]
+    shm_names = {k: f"flonb_{run_id}_{i}" for i, k in enumerate(dsk)}
+    wrapped_dsk = {
+        k: (
+            (_SharedMemoryTask(v[0], threshold, shm_names[k]), *v[1:])
+            if dask.core.istask(v)
+            else v
+        )
+        for k, v in dsk.items()
+    }
+    if kwargs.get("pool") is None:
+        kwargs.setdefault(
+            "initializer",
+            functools.partial(_init_worker, Cache._base_dirpath, Cache._storage),
+        )
+    try:
+        result = dask.multiprocessing.get(
+            wrapped_dsk,
+            keys,
+            num_workers=num_workers,
+            optimize_graph=False,
+            callbacks=[Callback(posttask=releaser.posttask)._callback],
+            **kwargs,
+        )
+        return _load_nested(result, keys)
+    finally:
+        releaser.release_all()
+        for name in shm_names.values():
+            SharedResult(name, 0).release()
+
+
+def _load_nested(result, keys):
+    """Loads shared results, following the (nested list) structure of `keys`"""
+    if isinstance(keys, list):
+        return type(result)(_load_nested(r, k) for r, k in zip(result, keys))
+    elif isinstance(result, (SharedResult, _PickledResult)):
+        return result.load()
+    return result
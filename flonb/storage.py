@@ -0,0 +1,795 @@
+"""Storage backends for `flonb.Cache`.
+
+A backend stores opaque `bytes` entries, addressed by a `category` (the task name)
+and a `name` (a hash of the task's graph key). Pass one to
+`flonb.set_cache_dir(..., storage=...)` to use it for `cache_disk=True` tasks.
+"""
+
+import collections
+import concurrent.futures
+import email.utils
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+
+
+class EntryStat(NamedTuple):
+    size: int
+    mtime: float
+
+
+class StorageBackend:
+    """Interface for cache storage backends.
+
+    `read` and `stat` raise `KeyError` for entries that don't exist.
+    Backends must be picklable, so they can be shipped to worker processes.
+    """
+
+    def location(self, category: str, name: str) -> str:
+        """Human-readable location of an entry, for logging."""
+        return f"{self!r}[{category}/{name}]"
+
+    def exists(self, category: str, name: str) -> bool:
+        raise NotImplementedError
+
+    def exists_many(self, category: str, names: Sequence[str]) -> List[bool]:
+        return [self.exists(category, name) for name in names]
+
+    def read(self, category: str, name: str) -> bytes:
+        raise NotImplementedError
+
+    def write(self, category: str, name: str, data: bytes):
+        raise NotImplementedError
+
+    def delete(self, category: str, name: str):
+        raise NotImplementedError
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        raise NotImplementedError
+
+
+class FileStorage(StorageBackend):
+    """One `<name>.pickle` file per entry, in a flat directory per category.
+
+    This is the original `flonb` cache layout.
+    """
+
+    def __init__(self, dirpath: str):
+        self.dirpath = dirpath
+
+    def __repr__(self):
+        return f"flonb.storage.FileStorage({self.dirpath!r})"
+
+    def _fpath(self, category: str, name: str) -> str:
+        return os.path.join(self.dirpath, category, f"{name}.pickle")
+
+    def location(self, category: str, name: str) -> str:
+        return self._fpath(category, name)
+
+    def exists(self, category: str, name: str) -> bool:
+        return os.path.exists(self._fpath(category, name))
+
+    def read(self, category: str, name: str) -> bytes:
+        try:
+            with open(self._fpath(category, name), "rb") as fd:
+                return fd.read()
+        except FileNotFoundError:
+            raise KeyError(f"{category}/{name}") from None
+
+    def write(self, category: str, name: str, data: bytes):
+        fpath = self._fpath(category, name)
+        os.makedirs(os.path.dirname(fpath), exist_ok=True)
+        _atomic_write(fpath, data)
+
+    def delete(self, category: str, name: str):
+        try:
+            os.remove(self._fpath(category, name))
+        except FileNotFoundError:
+            pass
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        return _stat_file(self._fpath(category, name), category, name)
+
+
+class PackedStorage(StorageBackend):
+    """Cache layout for many small entries.
+
+    Entries of at least `small_threshold` bytes are written as individual files in
+    hash-sharded subdirectories, e.g. `<dirpath>/<category>/3f/3fa2....pickle`.
+
+    Smaller entries are appended to packed segment files,
+    `<dirpath>/<category>/segments/<n>.seg`, and located with an append-only index,
+    `<dirpath>/<category>/segments/index`, of `<name> <segment> <offset> <length>`
+    lines. Reading a small entry is then a single seek + read. Segment and index
+    writes use `O_APPEND`, so several processes can write to the same category.
+
+    Overwritten and deleted entries leave dead space in the segments, which
+    `.compact()` reclaims. Do not compact while other processes write to the cache.
+    """
+
+    def __init__(
+        self,
+        dirpath: str,
+        small_threshold: int = 64 * 1024,
+        max_segment_size: int = 64 * 1024 * 1024,
+    ):
+        self.dirpath = dirpath
+        self.small_threshold = small_threshold
+        self.max_segment_size = max_segment_size
+        self._indexes: Dict[str, _SegmentIndex] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"flonb.storage.PackedStorage({self.dirpath!r})"
+
+    def __getstate__(self):
+        # locks can't be pickled, and the indexes are re-read lazily anyway
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_indexes"] = {}
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _shard_fpath(self, category: str, name: str) -> str:
+        return os.path.join(self.dirpath, category, name[:2], f"{name}.pickle")
+
+    def _segments_dir(self, category: str) -> str:
+        return os.path.join(self.dirpath, category, "segments")
+
+    def _index(self, category: str) -> "_SegmentIndex":
+        with self._lock:
+            if category not in self._indexes:
+                self._indexes[category] = _SegmentIndex(self._segments_dir(category))
+            index = self._indexes[category]
+        index.refresh()
+        return index
+
+    def location(self, category: str, name: str) -> str:
+        entry = self._index(category).get(name)
+        if entry is None:
+            return self._shard_fpath(category, name)
+        segment, offset, length = entry
+        return f"{self._segments_dir(category)}/{segment}.seg@{offset}+{length}"
+
+    def exists(self, category: str, name: str) -> bool:
+        if self._index(category).get(name) is not None:
+            return True
+        return os.path.exists(self._shard_fpath(category, name))
+
+    def read(self, category: str, name: str) -> bytes:
+        index = self._index(category)
+        entry = index.get(name)
+        if entry is None:
+            try:
+                with open(self._shard_fpath(category, name), "rb") as fd:
+                    return fd.read()
+            except FileNotFoundError:
+                raise KeyError(f"{category}/{name}") from None
+        segment, offset, length = entry
+        with open(index.segment_fpath(segment), "rb") as fd:
+            fd.seek(offset)
+            return fd.read(length)
+
+    def write(self, category: str, name: str, data: bytes):
+        index = self._index(category)
+        shard_fpath = self._shard_fpath(category, name)
+        with index.lock:
+            if len(data) >= self.small_threshold:
+                os.makedirs(os.path.dirname(shard_fpath), exist_ok=True)
+                _atomic_write(shard_fpath, data)
+                if index.get(name) is not None:
+                    index.append_tombstone(name)
+            else:
+                segment, offset = index.append_data(data, self.max_segment_size)
+                index.append_entry(name, segment, offset, len(data))
+                if os.path.exists(shard_fpath):
+                    os.remove(shard_fpath)
+
+    def delete(self, category: str, name: str):
+        index = self._index(category)
+        with index.lock:
+            if index.get(name) is not None:
+                index.append_tombstone(name)
+            try:
+                os.remove(self._shard_fpath(category, name))
+            except FileNotFoundError:
+                pass
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        index = self._index(category)
+        entry = index.get(name)
+        if entry is None:
+            return _stat_file(self._shard_fpath(category, name), category, name)
+        segment, _, length = entry
+        return EntryStat(length, os.path.getmtime(index.segment_fpath(segment)))
+
+    def dead_bytes(self, category: str) -> int:
+        """Bytes in the segment files not referenced by a live entry."""
+        return self._index(category).dead_bytes()
+
+    def compact(self, category: str = None):
+        """Rewrite the live small entries into fresh segments, dropping dead space.
+
+        Compacts every category in the cache if `category` is not given.
+        """
+        if category is None:
+            categories = [
+                c
+                for c in sorted(os.listdir(self.dirpath))
+                if os.path.isdir(self._segments_dir(c))
+            ]
+        else:
+            categories = [category]
+        for c in categories:
+            self._index(c).compact(self.max_segment_size)
+
+
+class _SegmentIndex:
+    """In-memory view of a category's segment index, tailed from the index file."""
+
+    def __init__(self, dirpath: str):
+        self.dirpath = dirpath
+        self.index_fpath = os.path.join(dirpath, "index")
+        self.entries: Dict[str, Tuple[int, int, int]] = {}
+        # held while the index is re-read, and across appending an entry's data,
+        # its index line and the refresh after it, so threads see each other's writes
+        self.lock = threading.RLock()
+        self._reset(inode=None)
+
+    def segment_fpath(self, segment: int) -> str:
+        return os.path.join(self.dirpath, f"{segment}.seg")
+
+    def _reset(self, inode):
+        self.entries = {}
+        self._inode = inode
+        self._pos = 0
+        self._partial = b""
+
+    def get(self, name: str):
+        with self.lock:
+            return self.entries.get(name)
+
+    def refresh(self):
+        with self.lock:
+            self._refresh()
+
+    def _refresh(self):
+        try:
+            stat = os.stat(self.index_fpath)
+        except FileNotFoundError:
+            self._reset(inode=None)
+            return
+        if stat.st_ino != self._inode or stat.st_size < self._pos:
+            # index was replaced by a compaction - start over
+            self._reset(inode=stat.st_ino)
+        if stat.st_size == self._pos:
+            return
+        with open(self.index_fpath, "rb") as fd:
+            fd.seek(self._pos)
+            chunk = self._partial + fd.read()
+            self._pos = fd.tell()
+        *lines, self._partial = chunk.split(b"\n")
+        for line in lines:
+            name, segment, offset, length = line.decode().split(" ")
+            if int(length) < 0:
+                self.entries.pop(name, None)
+            else:
+                self.entries[name] = (int(segment), int(offset), int(length))
+
+    def _segments(self):
+        return sorted(
+            int(fname[: -len(".seg")])
+            for fname in os.listdir(self.dirpath)
+            if fname.endswith(".seg")
+        )
+
+    def append_data(self, data: bytes, max_segment_size: int) -> Tuple[int, int]:
+        os.makedirs(self.dirpath, exist_ok=True)
+        segments = self._segments()
+        segment = segments[-1] if segments else 0
+        fpath = self.segment_fpath(segment)
+        if os.path.exists(fpath) and os.path.getsize(fpath) >= max_segment_size:
+            segment += 1
+            fpath = self.segment_fpath(segment)
+        # with O_APPEND the write lands atomically at the end of the file,
+        # so the offset is recovered from where the file pointer ends up
+        fd = os.open(fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            _write_all(fd, data)
+            offset = os.lseek(fd, 0, os.SEEK_CUR) - len(data)
+        finally:
+            os.close(fd)
+        return segment, offset
+
+    def _append_line(self, line: str):
+        with self.lock:
+            fd = os.open(
+                self.index_fpath, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644
+            )
+            try:
+                _write_all(fd, f"{line}\n".encode())
+            finally:
+                os.close(fd)
+            self._refresh()
+
+    def append_entry(self, name: str, segment: int, offset: int, length: int):
+        self._append_line(f"{name} {segment} {offset} {length}")
+
+    def append_tombstone(self, name: str):
+        self._append_line(f"{name} -1 -1 -1")
+
+    def dead_bytes(self) -> int:
+        if not os.path.isdir(self.dirpath):
+            return 0
+        with self.lock:
+            total = sum(
+                os.path.getsize(self.segment_fpath(s)) for s in self._segments()
+            )
+            return total - sum(length for _, _, length in self.entries.values())
+
+    def compact(self, max_segment_size: int):
+        with self.lock:
+            self._compact(max_segment_size)
+
+    def _compact(self, max_segment_size: int):
+        self._refresh()
+        old_segments = self._segments()
+        segment = old_segments[-1] + 1 if old_segments else 0
+        offset = 0
+        new_entries = {}
+        out = None
+        try:
+            for name, (old_segment, old_offset, length) in sorted(
+                self.entries.items(), key=lambda item: item[1]
+            ):
+                if out is None or offset >= max_segment_size:
+                    if out is not None:
+                        out.close()
+                        segment += 1
+                    out = open(self.segment_fpath(segment), "wb")
+                    offset = 0
+                with open(self.segment_fpath(old_segment), "rb") as fd:
+                    fd.seek(old_offset)
+                    out.write(fd.read(length))
+                new_entries[name] = (segment, offset, length)
+                offset += length
+        finally:
+            if out is not None:
+                out.close()
+        _atomic_write(
+            self.index_fpath,
+            "".join(
+                f"{name} {s} {o} {n}\n" for name, (s, o, n) in new_entries.items()
+            ).encode(),
+        )
+        for s in old_segments:
+            os.remove(self.segment_fpath(s))
+        self._refresh()
+
+
+class SQLiteStorage(StorageBackend):
+    """All entries in a single SQLite database file.
+
+    Safe to share between threads and processes on one machine.
+    """
+
+    def __init__(self, fpath: str, timeout: float = 60.0):
+        self.fpath = fpath
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def __repr__(self):
+        return f"flonb.storage.SQLiteStorage({self.fpath!r})"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = threading.local()
+
+    def _connection(self) -> sqlite3.Connection:
+        # connections can't be shared across threads, or survive a fork
+        conn = getattr(self._local, "conn", None)
+        if conn is None or self._local.pid != os.getpid():
+            dirpath = os.path.dirname(self.fpath)
+            if dirpath:
+                os.makedirs(dirpath, exist_ok=True)
+            conn = sqlite3.connect(self.fpath, timeout=self.timeout)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS entries ("
+                "category TEXT, name TEXT, data BLOB, mtime REAL, "
+                "PRIMARY KEY (category, name))"
+            )
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def exists(self, category: str, name: str) -> bool:
+        return self.exists_many(category, [name])[0]
+
+    def exists_many(self, category: str, names: Sequence[str]) -> List[bool]:
+        found = set()
+        conn = self._connection()
+        # stay well under SQLite's limit on the number of query parameters
+        for start in range(0, len(names), 500):
+            stop = start + 500
+            chunk = list(names[start:stop])
+            rows = conn.execute(
+                f"SELECT name FROM entries WHERE category = ? "
+                f"AND name IN ({', '.join('?' * len(chunk))})",
+                [category, *chunk],
+            )
+            found.update(row[0] for row in rows)
+        return [name in found for name in names]
+
+    def read(self, category: str, name: str) -> bytes:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT data FROM entries WHERE category = ? AND name = ?",
+                (category, name),
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise KeyError(f"{category}/{name}")
+        return bytes(row[0])
+
+    def write(self, category: str, name: str, data: bytes):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)",
+                (category, name, sqlite3.Binary(data), time.time()),
+            )
+
+    def delete(self, category: str, name: str):
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "DELETE FROM entries WHERE category = ? AND name = ?",
+                (category, name),
+            )
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        row = (
+            self._connection()
+            .execute(
+                "SELECT length(data), mtime FROM entries "
+                "WHERE category = ? AND name = ?",
+                (category, name),
+            )
+            .fetchone()
+        )
+        if row is None:
+            raise KeyError(f"{category}/{name}")
+        return EntryStat(*row)
+
+
+class HTTPObjectStoreClient:
+    """Minimal client for an object store that speaks plain HTTP verbs.
+
+    Objects live at `<base_url>/<key>`, and are fetched with GET, written with PUT,
+    removed with DELETE and checked with HEAD. Missing objects must give a 404.
+    Suits e.g. a WebDAV server, a presigned-URL gateway in front of S3, or a
+    stand-in server in tests.
+    """
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+
+    def __repr__(self):
+        return f"flonb.storage.HTTPObjectStoreClient({self.base_url!r})"
+
+    def _request(self, method: str, key: str, data: bytes = None):
+        url = f"{self.base_url}/{urllib.parse.quote(key)}"
+        request = urllib.request.Request(url, data=data, method=method)
+        try:
+            return urllib.request.urlopen(request, timeout=self.timeout)
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                raise KeyError(key) from None
+            raise
+
+    def get(self, key: str) -> bytes:
+        with self._request("GET", key) as response:
+            return response.read()
+
+    def put(self, key: str, data: bytes):
+        self._request("PUT", key, data).close()
+
+    def delete(self, key: str):
+        try:
+            self._request("DELETE", key).close()
+        except KeyError:
+            pass
+
+    def head(self, key: str) -> Optional[EntryStat]:
+        try:
+            response = self._request("HEAD", key)
+        except KeyError:
+            return None
+        with response:
+            last_modified = response.headers.get("Last-Modified")
+            mtime = (
+                email.utils.parsedate_to_datetime(last_modified).timestamp()
+                if last_modified
+                else 0.0
+            )
+            return EntryStat(int(response.headers.get("Content-Length", 0)), mtime)
+
+
+class ObjectStoreStorage(StorageBackend):
+    """Adapter from a key-value / object store client to a `StorageBackend`.
+
+    `client` needs the methods:
+      - `get(key) -> bytes`, raising `KeyError` for missing objects.
+      - `put(key, data)`
+      - `delete(key)`
+      - `head(key) -> Optional[EntryStat]`, `None` for missing objects.
+
+    e.g. `HTTPObjectStoreClient`. Entries are stored at `<prefix><category>/<name>`.
+    `exists_many` sends up to `max_workers` requests concurrently.
+    """
+
+    def __init__(self, client, prefix: str = "", max_workers: int = 16):
+        self.client = client
+        self.prefix = prefix
+        self.max_workers = max_workers
+
+    def __repr__(self):
+        return f"flonb.storage.ObjectStoreStorage({self.client!r}, {self.prefix!r})"
+
+    def _key(self, category: str, name: str) -> str:
+        return f"{self.prefix}{category}/{name}"
+
+    def location(self, category: str, name: str) -> str:
+        return f"{self.client!r}[{self._key(category, name)}]"
+
+    def exists(self, category: str, name: str) -> bool:
+        return self.client.head(self._key(category, name)) is not None
+
+    def exists_many(self, category: str, names: Sequence[str]) -> List[bool]:
+        if len(names) <= 1:
+            return [self.exists(category, name) for name in names]
+        with concurrent.futures.ThreadPoolExecutor(self.max_workers) as executor:
+            return list(executor.map(lambda name: self.exists(category, name), names))
+
+    def read(self, category: str, name: str) -> bytes:
+        try:
+            return self.client.get(self._key(category, name))
+        except KeyError:
+            raise KeyError(f"{category}/{name}") from None
+
+    def write(self, category: str, name: str, data: bytes):
+        self.client.put(self._key(category, name), data)
+
+    def delete(self, category: str, name: str):
+        self.client.delete(self._key(category, name))
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        stat = self.client.head(self._key(category, name))
+        if stat is None:
+            raise KeyError(f"{category}/{name}")
+        return stat
+
+
+class ReadThroughStorage(StorageBackend):
+    """A shared `remote` backend fronted by a node-local `local` backend.
+
+    Reads are served from `local` when possible. Entries only found on `remote`
+    are copied to `local` on first read, so each node fetches them once.
+    Writes go to both. e.g. for several machines working through one sweep:
+
+        storage = ReadThroughStorage(
+            remote=ObjectStoreStorage(HTTPObjectStoreClient("http://cache-host:8000")),
+            local=PackedStorage("/tmp/flonb-cache"),
+        )
+    """
+
+    def __init__(self, remote: StorageBackend, local: StorageBackend):
+        self.remote = remote
+        self.local = local
+
+    def __repr__(self):
+        return f"flonb.storage.ReadThroughStorage({self.remote!r}, {self.local!r})"
+
+    def location(self, category: str, name: str) -> str:
+        if self.local.exists(category, name):
+            return self.local.location(category, name)
+        return self.remote.location(category, name)
+
+    def exists(self, category: str, name: str) -> bool:
+        return self.local.exists(category, name) or self.remote.exists(category, name)
+
+    def exists_many(self, category: str, names: Sequence[str]) -> List[bool]:
+        exists = self.local.exists_many(category, names)
+        missing = [i for i, found in enumerate(exists) if not found]
+        remote_exists = self.remote.exists_many(category, [names[i] for i in missing])
+        for i, found in zip(missing, remote_exists):
+            exists[i] = found
+        return exists
+
+    def read(self, category: str, name: str) -> bytes:
+        try:
+            return self.local.read(category, name)
+        except KeyError:
+            pass
+        data = self.remote.read(category, name)
+        self.local.write(category, name, data)
+        return data
+
+    def write(self, category: str, name: str, data: bytes):
+        self.remote.write(category, name, data)
+        self.local.write(category, name, data)
+
+    def delete(self, category: str, name: str):
+        self.remote.delete(category, name)
+        self.local.delete(category, name)
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        try:
+            return self.local.stat(category, name)
+        except KeyError:
+            return self.remote.stat(category, name)
+
+
+class StorageStats:
+    """Write and deduplication counters of a `ContentAddressedStorage`"""
+
+    def __init__(self):
+        self.writes = 0
+        self.bytes_written = 0
+        self.blobs_written = 0
+        self.bytes_stored = 0
+        self.dedup_hits = 0
+        self.bytes_saved = 0
+        self.reads = 0
+        self.memory_hits = 0
+
+    def __repr__(self):
+        return (
+            f"flonb.storage.StorageStats\n"
+            f"writes:         {self.writes} ({self.bytes_written} bytes)\n"
+            f"blobs written:  {self.blobs_written} ({self.bytes_stored} bytes)\n"
+            f"dedup hits:     {self.dedup_hits} ({self.bytes_saved} bytes saved)\n"
+            f"reads:          {self.reads} ({self.memory_hits} from memory)"
+        )
+
+
+class ContentAddressedStorage(StorageBackend):
+    """Stores each distinct result once, however many entries it belongs to.
+
+    Each entry in `backend` holds only the sha256 digest of its data. The data
+    itself is written once per digest, as a blob in the `.blobs` category. Recently
+    read blobs are kept in memory, up to `memory_bytes`, and shared by all entries
+    pointing at them. Write, dedup and read counters are kept in `.stats`.
+
+    Deleting an entry leaves its blob in place, as other entries may point at it.
+    """
+
+    blob_category = ".blobs"
+
+    def __init__(self, backend: StorageBackend, memory_bytes: int = 64 * 1024 * 1024):
+        self.backend = backend
+        self.memory_bytes = memory_bytes
+        self.stats = StorageStats()
+        self._blobs: "collections.OrderedDict[str, bytes]" = collections.OrderedDict()
+        self._blobs_bytes = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return f"flonb.storage.ContentAddressedStorage({self.backend!r})"
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_lock"]
+        state["_blobs"] = collections.OrderedDict()
+        state["_blobs_bytes"] = 0
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _digest(self, category: str, name: str) -> str:
+        return self.backend.read(category, name).decode()
+
+    def location(self, category: str, name: str) -> str:
+        try:
+            digest = self._digest(category, name)
+        except KeyError:
+            return self.backend.location(category, name)
+        return self.backend.location(self.blob_category, digest)
+
+    def exists(self, category: str, name: str) -> bool:
+        return self.backend.exists(category, name)
+
+    def exists_many(self, category: str, names: Sequence[str]) -> List[bool]:
+        return self.backend.exists_many(category, names)
+
+    def read(self, category: str, name: str) -> bytes:
+        digest = self._digest(category, name)
+        with self._lock:
+            self.stats.reads += 1
+            data = self._blobs.get(digest)
+            if data is not None:
+                self.stats.memory_hits += 1
+                self._blobs.move_to_end(digest)
+                return data
+        data = self.backend.read(self.blob_category, digest)
+        self._remember(digest, data)
+        return data
+
+    def _remember(self, digest: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        with self._lock:
+            if digest in self._blobs:
+                return
+            self._blobs[digest] = data
+            self._blobs_bytes += len(data)
+            while self._blobs_bytes > self.memory_bytes:
+                _, evicted = self._blobs.popitem(last=False)
+                self._blobs_bytes -= len(evicted)
+
+    def write(self, category: str, name: str, data: bytes):
+        digest = hashlib.sha256(data).hexdigest()
+        is_new = not self.backend.exists(self.blob_category, digest)
+        if is_new:
+            self.backend.write(self.blob_category, digest, data)
+        self.backend.write(category, name, digest.encode())
+        with self._lock:
+            self.stats.writes += 1
+            self.stats.bytes_written += len(data)
+            if is_new:
+                self.stats.blobs_written += 1
+                self.stats.bytes_stored += len(data)
+            else:
+                self.stats.dedup_hits += 1
+                self.stats.bytes_saved += len(data)
+
+    def delete(self, category: str, name: str):
+        self.backend.delete(category, name)
+
+    def stat(self, category: str, name: str) -> EntryStat:
+        ref_stat = self.backend.stat(category, name)
+        blob_stat = self.backend.stat(self.blob_category, self._digest(category, name))
+        return EntryStat(blob_stat.size, ref_stat.mtime)
+
+
+def _stat_file(fpath: str, category: str, name: str) -> EntryStat:
+    try:
+        stat = os.stat(fpath)
+    except FileNotFoundError:
+        raise KeyError(f"{category}/{name}") from None
+    return EntryStat(stat.st_size, stat.st_mtime)
+
+
+def _write_all(fd: int, data: bytes):
+    view = memoryview(data)
+    while view:
+        n_written = os.write(fd, view)
+        view = view[n_written:]
+
+
+def _atomic_write(fpath: str, data: bytes):
+    tmp_fpath = f"{fpath}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_fpath, "wb") as fd:
+        fd.write(data)
+    os.replace(tmp_fpath, fpath)
@@ -2,19 +2,48 @@ import inspect
 import functools
 import hashlib
 import logging
-import os
 import pickle
+import time
 from typing import Callable, Dict, Tuple, Optional
 
 
 import dask
 import dask.optimization
+import dask.order
+
+from .journal import RunJournal
+from .prefetch import CachePrefetcher
+from .scheduler import Explanation, RuntimeHistory, _flush_runtimes, _record_runtime
+from .storage import FileStorage, PackedStorage, StorageBackend
 
 _logger = logging.getLogger("flonb")
 
 
-def set_cache_dir(dirpath: str):
-    Cache.set_dir(dirpath)
+def set_cache_dir(
+    dirpath: str, layout: str = "flat", storage: Optional[StorageBackend] = None
+):
+    """Set the directory `cache_disk=True` results are stored in.
+
+    `layout` is one of:
+      - "flat": one file per result, in a directory per task.
+      - "packed": small results are packed into segment files, large results are
+        stored in hash-sharded subdirectories. Better for very many small results.
+
+    Alternatively pass a `flonb.storage.StorageBackend` as `storage` to store results
+    elsewhere, e.g. in a SQLite database or an object store shared between machines.
+    `dirpath` is then only used for `flonb`'s own local bookkeeping.
+    """
+    Cache.set_dir(dirpath, layout=layout, storage=storage)
+
+
+def set_cache_prefetch(max_workers: int = 8, max_bytes: int = 256 * 1024 * 1024):
+    """Configure how `.compute()` reads cached results.
+
+    Cached results in the task graph are read ahead of time, up to `max_workers`
+    at a time, holding at most about `max_bytes` of results that haven't been used
+    yet. Set `max_workers=0` to read each cached result only when it's needed.
+    """
+    CachePrefetcher.configure(max_workers=max_workers, max_bytes=max_bytes)
 
 
 def task_func(func=None, *, cache_disk=False):
@@ -29,33 +58,58 @@ def task_func(func=None, *, cache_disk=False):
         return decorator(func)
 
 
+_CACHE_LAYOUTS = {"flat": FileStorage, "packed": PackedStorage}
+
+
 class Cache:
     _base_dirpath: str = None
+    _storage = None
 
     def __init__(self, category: str, key: str):
         self.category = category
         self.key = key
-        fname = hashlib.md5(str(key).encode()).hexdigest()
-        self.fpath = os.path.join(self._get_base_dir(), category, f"{fname}.pickle")
+        self.name = hashlib.md5(str(key).encode()).hexdigest()
 
     def exists(self) -> bool:
-        return os.path.exists(self.fpath)
+        return self._get_storage().exists(self.category, self.name)
 
     def read(self) -> object:
-        _logger.info(f"READING CACHE for {self.key} at {self.fpath}")
-        with open(self.fpath, "rb") as fd:
-            return pickle.load(fd)
+        return pickle.loads(self.read_bytes())
+
+    def read_bytes(self) -> bytes:
+        storage = self._get_storage()
+        if _logger.isEnabledFor(logging.INFO):
+            location = storage.location(self.category, self.name)
+            _logger.info(f"READING CACHE for {self.key} at {location}")
+        return storage.read(self.category, self.name)
 
     def write(self, data: object):
-        _logger.info(f"WRITING CACHE for {self.key} to {self.fpath}")
-        os.makedirs(os.path.dirname(self.fpath), exist_ok=True)
-        with open(self.fpath, "wb") as fd:
-            pickle.dump(data, fd)
-        _logger.info(f"WROTE CACHE for {self.key} to {self.fpath}")
+        storage = self._get_storage()
+        # finding the location can cost a lookup in some backends
+        log = _logger.isEnabledFor(logging.INFO)
+        if log:
+            location = storage.location(self.category, self.name)
+            _logger.info(f"WRITING CACHE for {self.key} to {location}")
+        storage.write(self.category, self.name, pickle.dumps(data))
+        if log:
+            _logger.info(f"WROTE CACHE for {self.key} to {location}")
 
     @classmethod
-    def set_dir(cls, dirpath: str):
+    def set_dir(
+        cls,
+        dirpath: str,
+        layout: str = "flat",
+        storage: Optional[StorageBackend] = None,
+    ):
+        if layout not in _CACHE_LAYOUTS:
+            raise ValueError(
+                f"Unknown cache layout '{layout}', "
+                f"choose from {sorted(_CACHE_LAYOUTS)}."
+            )
+        if storage is not None and layout != "flat":
+            raise ValueError("Supply only one of `layout` and `storage`.")
         cls._base_dirpath = dirpath
+        cls._storage = _CACHE_LAYOUTS[layout](dirpath) if storage is None else storage
 
     @classmethod
     def _get_base_dir(cls) -> str:
@@ -63,9 +117,15 @@ class Cache:
             raise ValueError("Set cache dir with `flonb.set_cache_dir`.")
         return cls._base_dirpath
 
+    @classmethod
+    def _get_storage(cls) -> StorageBackend:
+        cls._get_base_dir()
+        return cls._storage
+
     @classmethod
     def _reset(cls):
         cls._base_dirpath = None
+        cls._storage = None
 
 
 class Task:
@@ -137,8 +197,12 @@ class Task:
         @functools.wraps(self.func)
         def _graph_func_wrapper(*args, **kwargs):
             _logger.info(f"RUNNING {key}")
+            tic = time.perf_counter()
             result = self.func(*args, **kwargs)
+            runtime = time.perf_counter() - tic
             _logger.info(f"DONE {key}")
+            if Cache._base_dirpath is not None:
+                _record_runtime(Cache._base_dirpath, key, runtime)
             return result
 
         if not self.cache_disk:
@@ -151,16 +215,11 @@ class Task:
             cache.write(result)
             return cache.read()
 
+        write_cache_wrapper._flonb_cached = True
         return write_cache_wrapper
 
     def _get_cache_read_func(self, key: str) -> Callable:
-        def get_cached_data(*args):
-            return self._get_cache_obj(key).read()
-
-        return get_cached_data
-
-    def _cache_exists(self, key):
-        return self._get_cache_obj(key).exists()
+        return _CacheReadFunc(self._get_cache_obj(key))
 
     def partial(self, **options):
         options = _check_and_combine_options(self, options)
@@ -168,19 +227,102 @@ class Task:
 
     def graph_and_key(self, **options):
         graph = {}  # singleton that is built throughout recursive calls
-        used_options, key = _build_graph(self, options, graph)
+        cache_candidates = {}  # likewise, cache_disk nodes that may be cache hits
+        used_options, key = _build_graph(self, options, graph, cache_candidates)
 
         excess_options = set(options) - set(used_options)
         if excess_options:
             raise ValueError(f"Excess options supplied: {sorted(excess_options)}.")
+        _use_cache_hits(graph, cache_candidates)
         graph, _ = dask.optimization.cull(graph, key)
         return graph, key
 
-    def compute(self, **options):
+    def explain(self, **options) -> Explanation:
+        """Dry run: which tasks would run or hit the cache, and how long they'd take.
+
+        Runtimes are estimated from previous runs recorded in the cache dir.
+        Nothing is computed.
+        """
         graph, key = self.graph_and_key(**options)
+        history = None
+        if Cache._base_dirpath is not None:
+            history = RuntimeHistory(Cache._base_dirpath)
+        return Explanation(graph, key, history)
+
+    def compute(self, checkpoint: bool = False, **options):
+        """Compute the task with the supplied options.
+
+        With `checkpoint=True` the results of tasks without `cache_disk=True` are
+        saved to a journal in the cache dir as they finish. If the run dies, rerunning
+        with the same options picks up where it left off. The journal is deleted once
+        the run succeeds.
+        """
+        graph, key = self._graph_and_key_to_compute(**options)
+        return _compute_graph(graph, key, checkpoint=checkpoint)
+
+    def _graph_and_key_to_compute(self, **options):
+        """`graph_and_key`, explaining a clash with the `checkpoint` argument"""
+        try:
+            return self.graph_and_key(**options)
+        except _MissingOptionError as e:
+            if e.opt != "checkpoint":
+                raise
+            raise ValueError(
+                f"Task '{self.__name__}' uses an option named 'checkpoint', which "
+                f"clashes with the `checkpoint` argument of `.compute`. Supply the "
+                f"option with `.partial(checkpoint=...)`, or rename it."
+            ) from None
+
+
+def _compute_graph(graph: dict, key: Tuple[str], checkpoint: bool = False):
+    """Runs a graph from `Task.graph_and_key`, with journaling and cache prefetching"""
+    if checkpoint:
+        with RunJournal.for_run(Cache._get_base_dir(), key) as journal:
+            result = _get(journal.resume(graph, key), key)
+            journal.remove()
+        return result
+    return _get(graph, key)
+
+
+def _get(graph: dict, key: Tuple[str]):
+    cache_read_keys = [
+        k
+        for k, v in graph.items()
+        if isinstance(v, tuple) and isinstance(v[0], _CacheReadFunc)
+    ]
+    try:
+        if cache_read_keys and CachePrefetcher.max_workers > 0:
+            return _get_with_prefetch(graph, key, cache_read_keys)
+        return dask.get(graph, key)
+    finally:
+        _flush_runtimes()
+
+
+def _get_with_prefetch(graph: dict, key: Tuple[str], cache_read_keys: list):
+    # prefetch in the order dask.get will run the nodes
+    priorities = dask.order.order(graph)
+    cache_reads = {
+        k: graph[k][0].cache for k in sorted(cache_read_keys, key=priorities.get)
+    }
+    with CachePrefetcher(cache_reads) as prefetcher:
+        for k in cache_reads:
+            graph[k] = (prefetcher.get_func(k), *graph[k][1:])
         return dask.get(graph, key)
 
 
+class _CacheReadFunc:
+    """Graph function that reads a task's result from the cache"""
+
+    _flonb_cached = True
+    _flonb_cache_read = True
+
+    def __init__(self, cache: Cache):
+        self.cache = cache
+
+    def __call__(self, *args):
+        return self.cache.read()
+
+
 class Dep:
     def __init__(self, dep):
         self.dep = dep
@@ -217,14 +359,20 @@ def _get_graph_key(task: Task, used_options: Dict) -> Tuple[str]:
     return tuple([task.__name__, ", ".join(option_strs)])
 
 
+class _MissingOptionError(ValueError):
+    def __init__(self, opt: str):
+        super().__init__(f"Missing option '{opt}'.")
+        self.opt = opt
+
+
 def _get_option(options: dict, opt: str):
     """Dictionary look-up with flonb specific error message"""
     if opt in options:
         return options[opt]
-    raise ValueError(f"Missing option '{opt}'.")
+    raise _MissingOptionError(opt)
 
 
-def _build_graph(task: Task, options: dict, graph: dict):
+def _build_graph(task: Task, options: dict, graph: dict, cache_candidates: dict):
     # See https://docs.dask.org/en/stable/graphs.html
     # build an s-expression, e.g.
     # (task.func, arg1_key, arg2_key)
@@ -248,20 +396,21 @@ def _build_graph(task: Task, options: dict, graph: dict):
             # step through all the deps,
             # recursively calling `_build_graph` (the function we are in right now!)
             dep_used_options, dep_keys = _add_deps_to_graph(
-                task.deps[arg], available_options, graph
+                task.deps[arg], available_options, graph, cache_candidates
             )
             s_expr.append(dep_keys)
             used_options.update(dep_used_options)
 
     identifying_options = {**task.presupplied_options, **used_options}
     graph_key = _get_graph_key(task, identifying_options)
-    if task.cache_disk and task._cache_exists(graph_key):
-        s_expr = [task._get_cache_read_func(graph_key)]
-        for opt, opt_val in identifying_options.items():
-            s_expr.append((opt, f"{opt}={opt_val}"))
-    else:
-        s_expr.insert(0, task._get_graph_func(graph_key))
+    s_expr.insert(0, task._get_graph_func(graph_key))
     graph[graph_key] = tuple(s_expr)
+    if task.cache_disk:
+        # swapped for a cache read by `_use_cache_hits`, if the cache exists
+        cache_read_s_expr = [task._get_cache_read_func(graph_key)]
+        for opt, opt_val in identifying_options.items():
+            cache_read_s_expr.append((opt, f"{opt}={opt_val}"))
+        cache_candidates[graph_key] = tuple(cache_read_s_expr)
 
     for presupplied_opt, presupplied_opt_val in task.presupplied_options.items():
         if presupplied_opt not in used_options:
@@ -274,28 +423,45 @@ def _build_graph(task: Task, options: dict, graph: dict):
     return used_options, graph_key
 
 
-def _add_deps_to_graph(deps, options: dict, graph: dict):
+def _use_cache_hits(graph: dict, cache_candidates: dict):
+    """Swaps cache_disk nodes with a cached result for cache reads.
+    Checks which caches exist with one batched call per task.
+    """
+    by_category = {}
+    for graph_key, s_expr in cache_candidates.items():
+        cache = s_expr[0].cache
+        by_category.setdefault(cache.category, []).append((graph_key, cache.name))
+    for category, keys_and_names in by_category.items():
+        exists = Cache._get_storage().exists_many(
+            category, [name for _, name in keys_and_names]
+        )
+        for (graph_key, _), cache_exists in zip(keys_and_names, exists):
+            if cache_exists:
+                graph[graph_key] = cache_candidates[graph_key]
+
+
+def _add_deps_to_graph(deps, options: dict, graph: dict, cache_candidates: dict):
     """Step recursively down through the depencies.
     Calls `_build_graph` on each Task.
     Replaces Tasks in deps with their graph keys, to build the s-expression.
     """
     if isinstance(deps, Task):
-        return _build_graph(deps, options, graph)
+        return _build_graph(deps, options, graph, cache_candidates)
     elif isinstance(deps, list):
         used_options = {}
         s_expr = []
         for d in deps:
             this_dep_used_opts, this_dep_graph_key = _add_deps_to_graph(
-                d, options, graph
+                d, options, graph, cache_candidates
             )
             used_options.update(this_dep_used_opts)
             s_expr.append(this_dep_graph_key)
         return used_options, s_expr
     elif isinstance(deps, Dep):
-        return _add_deps_to_graph(deps.dep, options, graph)
+        return _add_deps_to_graph(deps.dep, options, graph, cache_candidates)
     elif isinstance(deps, DynamicDep):
         used_options, graph_key = _add_deps_to_graph(
-            deps.get_dep(options), options, graph
+            deps.get_dep(options), options, graph, cache_candidates
         )
         used_options.update({k: options[k] for k in deps.option_names})
         return used_options, graph_key
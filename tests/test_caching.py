@@ -1,6 +1,14 @@
+import logging
+import pickle
+import threading
+import time
+
+import dask.order
 import pytest
 
 import flonb
+from flonb.prefetch import CachePrefetcher
+from flonb.storage import FileStorage
 from flonb.task import Cache
 
 
@@ -67,3 +75,197 @@ def test_cache_disk_with_options_and_deps(tmpdir):
 
     assert _add_one_xs == [3, 2, 5, 2, 1]
     assert _multiply_ys == [2, 3, 3, 2, 4]
+
+
+class _RecordingStorage(FileStorage):
+    def __init__(self, dirpath):
+        super().__init__(dirpath)
+        self.read_threads = []
+        self.read_names = []
+        self.exists_calls = []
+        self.location_calls = 0
+
+    def location(self, category, name):
+        self.location_calls += 1
+        return super().location(category, name)
+
+    def exists(self, category, name):
+        self.exists_calls.append((category, 1))
+        return super().exists(category, name)
+
+    def exists_many(self, category, names):
+        self.exists_calls.append((category, len(names)))
+        return [super(_RecordingStorage, self).exists(category, n) for n in names]
+
+    def read(self, category, name):
+        self.read_threads.append(threading.current_thread().name)
+        self.read_names.append(name)
+        return super().read(category, name)
+
+
+@pytest.fixture
+def prefetch_config():
+    yield
+    flonb.set_cache_prefetch()
+
+
+def _make_sum_of_cached_squares():
+    @flonb.task_func(cache_disk=True)
+    def square(x):
+        return x**2
+
+    @flonb.task_func()
+    def sum_squares(squares=flonb.Dep([square.partial(x=x) for x in range(20)])):
+        return sum(squares)
+
+    return sum_squares
+
+
+def test_cache_prefetch(tmpdir, prefetch_config):
+    storage = _RecordingStorage(tmpdir.strpath)
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+    sum_squares = _make_sum_of_cached_squares()
+
+    expected = sum(x**2 for x in range(20))
+    assert sum_squares.compute() == expected
+    storage.read_threads.clear()
+
+    # each cached square is read once, whether prefetched or not
+    assert sum_squares.compute() == expected
+    assert len(storage.read_threads) == 20
+    assert any(t.startswith("flonb-prefetch") for t in storage.read_threads)
+
+
+def test_cache_prefetch_in_execution_order(tmpdir, prefetch_config):
+    storage = _RecordingStorage(tmpdir.strpath)
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+    sum_squares = _make_sum_of_cached_squares()
+    sum_squares.compute()
+
+    graph, _ = sum_squares.graph_and_key()
+    priorities = dask.order.order(graph)
+    expected_names = [
+        Cache(*k[:1], k).name
+        for k in sorted(graph, key=priorities.get)
+        if k[0] == "square"
+    ]
+
+    # with room for one result at a time, reads follow the order results are used
+    flonb.set_cache_prefetch(max_workers=1, max_bytes=1)
+    storage.read_names.clear()
+    sum_squares.compute()
+    assert storage.read_names == expected_names
+
+
+class _FakeCache:
+    def __init__(self, data, started):
+        self.data = data
+        self.started = started
+
+    def read_bytes(self):
+        self.started.append(threading.current_thread().name)
+        return pickle.dumps(self.data)
+
+    def read(self):
+        return pickle.loads(self.read_bytes())
+
+
+def test_cache_prefetcher_reads_ahead(prefetch_config):
+    started = []
+    caches = {i: _FakeCache(i, started) for i in range(10)}
+    with CachePrefetcher(caches) as prefetcher:
+        while len(started) < 10:
+            time.sleep(0.01)
+        assert all(t.startswith("flonb-prefetch") for t in started)
+        assert [prefetcher.get_func(i)() for i in range(10)] == list(range(10))
+    assert len(started) == 10
+
+
+def test_cache_prefetcher_memory_cap(prefetch_config):
+    flonb.set_cache_prefetch(max_workers=1, max_bytes=1)
+    started = []
+    caches = {i: _FakeCache(i, started) for i in range(3)}
+    with CachePrefetcher(caches) as prefetcher:
+        while not started:
+            time.sleep(0.01)
+        time.sleep(0.1)
+        assert len(started) == 1  # waits for the first result to be used
+        assert prefetcher.get(0) == 0
+        assert prefetcher.get(1) == 1
+        assert prefetcher.get(2) == 2
+    assert len(started) == 3
+
+
+def test_cache_prefetch_memory_cap(tmpdir, prefetch_config):
+    storage = _RecordingStorage(tmpdir.strpath)
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+    sum_squares = _make_sum_of_cached_squares()
+    expected = sum(x**2 for x in range(20))
+    sum_squares.compute()
+    storage.read_threads.clear()
+
+    flonb.set_cache_prefetch(max_workers=2, max_bytes=1)
+    assert sum_squares.compute() == expected
+    assert len(storage.read_threads) == 20
+
+    flonb.set_cache_prefetch(max_workers=0)
+    storage.read_threads.clear()
+    assert sum_squares.compute() == expected
+    assert storage.read_threads == [threading.main_thread().name] * 20
+
+
+def test_cache_exists_checked_in_one_batch(tmpdir):
+    storage = _RecordingStorage(tmpdir.strpath)
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+    sum_squares = _make_sum_of_cached_squares()
+
+    expected = sum(x**2 for x in range(20))
+    assert sum_squares.compute() == expected
+    assert sum_squares.compute() == expected
+    # one batched check of all 20 squares per run
+    assert storage.exists_calls == [("square", 20), ("square", 20)]
+
+
+def test_cache_location_only_looked_up_for_logging(tmpdir, caplog):
+    storage = _RecordingStorage(tmpdir.strpath)
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+    sum_squares = _make_sum_of_cached_squares()
+
+    with caplog.at_level(logging.WARNING, logger="flonb"):
+        sum_squares.compute()
+        sum_squares.compute()
+    assert storage.location_calls == 0
+
+    with caplog.at_level(logging.INFO, logger="flonb"):
+        sum_squares.compute()
+    assert storage.location_calls == 20
+    assert "READING CACHE" in caplog.text
+
+
+def test_uncached_compute_skips_prefetching(tmpdir, prefetch_config, monkeypatch):
+    n_orders = [0]
+    order = dask.order.order
+
+    def counting_order(*args, **kwargs):
+        n_orders[0] += 1
+        return order(*args, **kwargs)
+
+    monkeypatch.setattr(dask.order, "order", counting_order)
+
+    @flonb.task_func()
+    def add(x, y):
+        return x + y
+
+    assert add.compute(x=1, y=2) == 3
+    assert n_orders[0] == 0
+
+    flonb.set_cache_dir(tmpdir.strpath)
+    sum_squares = _make_sum_of_cached_squares()
+    sum_squares.compute()
+    flonb.set_cache_prefetch(max_workers=0)
+    sum_squares.compute()
+    assert n_orders[0] == 0  # prefetching is off
+
+    flonb.set_cache_prefetch()
+    sum_squares.compute()
+    assert n_orders[0] == 1
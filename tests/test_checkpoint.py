@@ -0,0 +1,141 @@
+import os
+
+import pytest
+
+import flonb
+from flonb.journal import RunJournal
+
+
+class Crash(Exception):
+    pass
+
+
+def test_checkpoint_resumes_after_crash(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+    calls = []
+    crash = [True]
+
+    @flonb.task_func()
+    def load(x):
+        calls.append("load")
+        return list(range(x))
+
+    @flonb.task_func()
+    def square(data=flonb.Dep(load)):
+        calls.append("square")
+        return [d**2 for d in data]
+
+    @flonb.task_func()
+    def total(offset, squares=flonb.Dep(square)):
+        calls.append("total")
+        if crash[0]:
+            raise Crash
+        return sum(squares) + offset
+
+    with pytest.raises(Crash):
+        total.compute(checkpoint=True, x=4, offset=1)
+    assert calls == ["load", "square", "total"]
+
+    crash[0] = False
+    calls.clear()
+    assert total.compute(checkpoint=True, x=4, offset=1) == 15
+    assert calls == ["total"]  # skipped straight to the unfinished task
+
+    # the journal is removed after a successful run
+    assert os.listdir(os.path.join(tmpdir.strpath, ".flonb", "journals")) == []
+    calls.clear()
+    assert total.compute(checkpoint=True, x=4, offset=1) == 15
+    assert calls == ["load", "square", "total"]
+
+
+def test_checkpoint_is_per_options(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+    calls = []
+
+    @flonb.task_func()
+    def double(x):
+        calls.append(x)
+        return 2 * x
+
+    @flonb.task_func()
+    def fail(y, doubled=flonb.Dep(double)):
+        raise Crash
+
+    with pytest.raises(Crash):
+        fail.compute(checkpoint=True, x=1, y=0)
+    with pytest.raises(Crash):
+        fail.compute(checkpoint=True, x=1, y=1)  # a different run
+    with pytest.raises(Crash):
+        fail.compute(checkpoint=True, x=1, y=0)
+    assert calls == [1, 1]
+
+
+def test_checkpoint_skips_cache_disk_tasks(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func(cache_disk=True)
+    def cached(x):
+        return x
+
+    @flonb.task_func()
+    def unpicklable(y):
+        return lambda: y
+
+    @flonb.task_func()
+    def fail(a=flonb.Dep(cached), b=flonb.Dep(unpicklable)):
+        raise Crash
+
+    with pytest.raises(Crash):
+        fail.compute(checkpoint=True, x=1, y=2)
+
+    # nothing journaled: `cached` is in the cache, `unpicklable` can't be saved
+    assert os.listdir(os.path.join(tmpdir.strpath, ".flonb", "journals")) == []
+
+
+def test_checkpoint_requires_cache_dir():
+    flonb.task.Cache._reset()
+
+    @flonb.task_func()
+    def add(x, y):
+        return x + y
+
+    assert add.compute(x=1, y=2) == 3
+    with pytest.raises(ValueError) as excinfo:
+        add.compute(checkpoint=True, x=1, y=2)
+    assert "Set cache dir with `flonb.set_cache_dir`." in str(excinfo.value)
+
+
+def test_checkpoint_option_clash(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func()
+    def load(checkpoint):
+        return f"weights from {checkpoint}"
+
+    @flonb.task_func()
+    def train(weights=flonb.Dep(load)):
+        return weights
+
+    with pytest.raises(ValueError) as excinfo:
+        train.compute(checkpoint="model.pt")
+    assert "uses an option named 'checkpoint'" in str(excinfo.value)
+    assert train.partial(checkpoint="model.pt").compute() == "weights from model.pt"
+
+
+@pytest.mark.skipif(os.name == "nt", reason="journals are only locked on Unix")
+def test_concurrent_runs_share_journal(tmpdir):
+    key = ("total", "x=4")
+    first = RunJournal.for_run(tmpdir.strpath, key)
+    second = RunJournal.for_run(tmpdir.strpath, key)
+    with first, second:
+        first.record(("load", "x=4"), [0, 1, 2, 3])
+        first.remove()  # the second run is still going
+        assert second.read(("load", "x=4")) == [0, 1, 2, 3]
+        second.remove()
+    assert not os.path.exists(first.dirpath)
+
+    # a run waiting for the lock while the journal was removed gets a fresh one
+    with RunJournal.for_run(tmpdir.strpath, key) as third:
+        assert third.completed() == set()
+        third.record(("load", "x=4"), [0])
+        assert third.read(("load", "x=4")) == [0]
@@ -0,0 +1,216 @@
+import os
+
+import pytest
+
+import flonb
+import flonb.scheduler
+from flonb.journal import _hash_key
+from flonb.scheduler import RuntimeHistory, critical_path, estimate_makespan
+
+
+def test_runtime_history(tmpdir):
+    history = RuntimeHistory(tmpdir.strpath, default_runtime=0.5)
+    assert history.estimate(("load", "x=1")) == 0.5
+
+    history.record(("load", "x=1"), 1.0)
+    history.record(("load", "x=1"), 3.0)
+    history.record(("load", "x=2"), 8.0)
+    assert history.estimate(("load", "x=1")) == 2.0
+    assert history.estimate(("load", "x=2")) == 8.0
+    # unseen options fall back to other runs of the same task
+    assert history.estimate(("load", "x=3")) == 4.0
+    assert history.has_runtime(("load", "x=2"))
+    assert not history.has_runtime(("load", "x=3"))
+
+    # only the most recent runs count
+    for _ in range(RuntimeHistory.n_recent):
+        history.record(("load", "x=1"), 5.0)
+    assert RuntimeHistory(tmpdir.strpath).estimate(("load", "x=1")) == 5.0
+
+
+def test_runtime_history_compacted(tmpdir, monkeypatch):
+    monkeypatch.setattr(RuntimeHistory, "max_bytes", 2000)
+    history = RuntimeHistory(tmpdir.strpath)
+    for i in range(100):
+        history.record(("load", "x=1"), 1.0 if i < 95 else 2.0)
+        history.estimate(("load", "x=1"))  # read the log as it's compacted
+    for i in range(10):
+        history.record(("load", f"x={i + 2}"), 4.0)
+
+    assert os.path.getsize(history.fpath) <= 2000
+    assert history.estimate(("load", "x=1")) == 2.0
+    assert history.estimate(("load", "x=5")) == 4.0
+    assert RuntimeHistory(tmpdir.strpath).estimate(("load", "x=1")) == 2.0
+
+    history.compact()
+    assert history.estimate(("load", "x=1")) == 2.0
+    with open(history.fpath) as fd:
+        assert sum(line.startswith(_hash_key(("load", "x=1"))) for line in fd) == 5
+
+
+def test_compute_records_runtimes(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func()
+    def add(x, y):
+        return x + y
+
+    add.compute(x=1, y=2)
+    assert RuntimeHistory(tmpdir.strpath).has_runtime(("add", "x=1, y=2"))
+
+
+def test_runtimes_recorded_once_per_run(tmpdir, monkeypatch):
+    flonb.set_cache_dir(tmpdir.strpath)
+    batches = []
+    record_many = RuntimeHistory.record_many
+
+    def recording_record_many(self, runs):
+        batches.append(len(runs))
+        record_many(self, runs)
+
+    monkeypatch.setattr(RuntimeHistory, "record_many", recording_record_many)
+
+    @flonb.task_func()
+    def square(x):
+        return x**2
+
+    @flonb.task_func()
+    def total(squares=flonb.Dep([square.partial(x=x) for x in range(20)])):
+        return sum(squares)
+
+    total.compute()
+    assert batches == [21]
+    assert RuntimeHistory(tmpdir.strpath).has_runtime(("square", "x=7"))
+
+
+def test_recording_runtimes_is_best_effort(tmpdir, caplog):
+    with open(os.path.join(tmpdir.strpath, ".flonb"), "w"):
+        pass  # no room for the runtimes log
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func()
+    def add(x, y):
+        return x + y
+
+    assert add.compute(x=1, y=2) == 3
+    assert "Couldn't record task runtimes" in caplog.text
+    flonb.task.Cache._reset()
+
+
+def test_estimate_makespan_and_critical_path():
+    dsk = {"a": (abs, 1), "b": (abs, "a"), "c": (abs, 2), "d": (max, "b", "c")}
+    costs = {"a": 2.0, "b": 3.0, "c": 4.0, "d": 1.0}
+    assert critical_path(dsk, costs) == ["a", "b", "d"]
+    assert estimate_makespan(dsk, costs, num_workers=1) == 10.0
+    assert estimate_makespan(dsk, costs, num_workers=2) == 6.0
+
+
+def test_scheduler_get():
+    @flonb.task_func()
+    def multiply(x, y):
+        return x * y
+
+    @flonb.task_func()
+    def collect(
+        products=flonb.Dep(
+            [[multiply.partial(x=x, y=y) for x in range(3)] for y in range(2)]
+        ),
+    ):
+        return "products", products
+
+    graph, key = collect.graph_and_key()
+    assert flonb.scheduler.get(graph, key, num_workers=2) == (
+        "products",
+        [[0, 0, 0], [0, 1, 2]],
+    )
+    assert flonb.scheduler.get(graph, [key, [key]]) == [
+        collect.compute(),
+        [collect.compute()],
+    ]
+
+
+def test_scheduler_runs_critical_path_first(tmpdir):
+    history = RuntimeHistory(tmpdir.strpath)
+    history.record(("quick", ""), 5.0)
+    history.record(("slow", ""), 1.0)
+    history.record(("after_slow", ""), 10.0)
+
+    started = []
+
+    def run(name, *args):
+        started.append(name)
+        return name
+
+    dsk = {
+        ("quick", ""): (run, "quick"),
+        ("slow", ""): (run, "slow"),
+        ("after_slow", ""): (run, "after_slow", ("slow", "")),
+        ("total", ""): (list, [("quick", ""), ("after_slow", "")]),
+    }
+    result = flonb.scheduler.get(dsk, ("total", ""), num_workers=1, history=history)
+    assert result == ["quick", "after_slow"]
+    # "slow" is cheap, but leads to the most expensive task
+    assert started == ["slow", "after_slow", "quick"]
+
+
+def test_scheduler_raises_task_errors():
+    class MyError(Exception):
+        pass
+
+    def fail():
+        raise MyError
+
+    with pytest.raises(MyError):
+        flonb.scheduler.get({"a": (fail,), "b": (abs, "a")}, "b")
+
+
+def test_explain(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func(cache_disk=True)
+    def load(x):
+        return x
+
+    @flonb.task_func()
+    def process(y, data=flonb.Dep(load)):
+        return data + y
+
+    load.compute(x=1)
+    history = RuntimeHistory(tmpdir.strpath)
+    history.record(("process", "x=1, y=2"), 2.0)
+    history.record(("load", "x=2"), 3.0)
+
+    explanation = process.explain(x=1, y=2)
+    assert [(n.key, n.cache_hit) for n in explanation.nodes] == [
+        (("load", "x=1"), True),
+        (("process", "x=1, y=2"), False),
+    ]
+    assert explanation.nodes[1].critical
+    assert explanation.makespan() == pytest.approx(2.0)
+
+    explanation = process.explain(x=2, y=2)
+    assert [n.cache_hit for n in explanation.nodes] == [False, False]
+    assert explanation.makespan() == pytest.approx(3.0 + 2.0)
+    assert "estimated makespan:   5.000s" in repr(explanation)
+
+
+def test_explain_runtime_per_scheduler(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath)
+
+    @flonb.task_func()
+    def load(x):
+        return x
+
+    @flonb.task_func()
+    def combine(data=flonb.Dep([load.partial(x=x) for x in range(4)])):
+        return data
+
+    history = RuntimeHistory(tmpdir.strpath)
+    for x in range(4):
+        history.record(("load", f"x={x}"), 1.0)
+
+    explanation = combine.explain()
+    assert explanation.serial_runtime == pytest.approx(4.0)
+    assert explanation.makespan(num_workers=1) == pytest.approx(4.0)
+    assert explanation.makespan(num_workers=2) == pytest.approx(2.0)
+    assert "estimated runtime:    4.000s with `.compute()`" in repr(explanation)
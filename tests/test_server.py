@@ -0,0 +1,170 @@
+import os
+import pickle
+import socket
+import threading
+import time
+
+import pytest
+
+import flonb
+import flonb.server
+from flonb.server import _HEADER, _recv
+
+_slow_calls = []
+
+
+@flonb.task_func()
+def slow_square(x):
+    _slow_calls.append(x)
+    time.sleep(0.3)
+    return x**2
+
+
+@flonb.task_func()
+def add_to_square(y, square=flonb.Dep(slow_square)):
+    return square + y
+
+
+@flonb.task_func()
+def fails(x):
+    raise KeyError(x)
+
+
+@pytest.fixture
+def server(tmpdir):
+    socket_path = os.path.join(tmpdir.strpath, "flonb.sock")
+    server = flonb.server.WorkerPoolServer(socket_path, preload=["tests.test_server"])
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+    assert not os.path.exists(socket_path)
+
+
+def test_client_compute(server):
+    client = flonb.server.Client(server.socket_path)
+    assert client.compute("tests.test_server:slow_square", x=3) == 9
+    assert client.compute(add_to_square, x=3, y=1) == 10
+    assert client.compute(add_to_square.partial(y=2), x=3) == 11
+
+
+def test_client_compute_errors(server):
+    client = flonb.server.Client(server.socket_path)
+    with pytest.raises(KeyError):
+        client.compute(fails, x=1)
+    with pytest.raises(ValueError) as excinfo:
+        client.compute(add_to_square, x=1)
+    assert "Missing option 'y'." in str(excinfo.value)
+    with pytest.raises(ValueError) as excinfo:
+        client.compute("tests.test_server:_slow_calls")
+    assert "'tests.test_server:_slow_calls' is not a `flonb.Task`." in str(
+        excinfo.value
+    )
+    assert server.stats.errors == 3
+
+
+def test_bad_requests_get_error_responses(server):
+    for data in [b"not a pickle", pickle.dumps("not a request")]:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+            sock.connect(server.socket_path)
+            sock.sendall(_HEADER.pack(len(data)) + data)
+            status, error = _recv(sock)
+        assert status == "error"
+        assert isinstance(error, Exception)
+    assert server.stats.errors == 2
+
+
+def test_inflight_nodes_are_deduped(server):
+    _slow_calls.clear()
+    client = flonb.server.Client(server.socket_path)
+    results = {}
+
+    def compute(y):
+        results[y] = client.compute(add_to_square, x=4, y=y)
+
+    threads = [threading.Thread(target=compute, args=(y,)) for y in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == {0: 16, 1: 17, 2: 18}
+    assert _slow_calls == [4]  # computed once, shared by all three requests
+    assert server.stats.nodes_deduped == 2
+
+
+def test_server_replaces_only_stale_sockets(server, tmpdir):
+    with pytest.raises(OSError) as excinfo:
+        flonb.server.WorkerPoolServer(server.socket_path)
+    assert "A server is already listening" in str(excinfo.value)
+    client = flonb.server.Client(server.socket_path)
+    assert client.compute("tests.test_server:slow_square", x=2) == 4
+
+    # left behind by a server that died
+    stale_path = os.path.join(tmpdir.strpath, "stale.sock")
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.bind(stale_path)
+    with flonb.server.WorkerPoolServer(stale_path) as new_server:
+        assert new_server.socket_path == stale_path
+
+
+def test_deduped_results_are_copies():
+    inflight = flonb.server._InflightNodes(flonb.server.ServerStats())
+    started, finish = threading.Event(), threading.Event()
+
+    def make_list():
+        started.set()
+        finish.wait()
+        return [1, 2]
+
+    run_once = inflight._wrap("key", make_list)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(run_once()))]
+    threads[0].start()
+    started.wait()
+    threads.append(threading.Thread(target=lambda: results.append(run_once())))
+    threads[1].start()
+    while not inflight.stats.nodes_deduped:
+        time.sleep(0.01)
+    finish.set()
+    for thread in threads:
+        thread.join()
+
+    assert results == [[1, 2], [1, 2]]
+    assert results[0] is not results[1]
+
+
+def test_same_named_tasks_are_not_deduped(tmpdir, monkeypatch):
+    for name in ["pipe_a", "pipe_b"]:
+        with open(os.path.join(tmpdir.strpath, f"{name}.py"), "w") as fd:
+            fd.write(
+                "import time\n"
+                "import flonb\n"
+                "@flonb.task_func()\n"
+                "def load(x):\n"
+                "    time.sleep(0.3)\n"
+                f"    return '{name}' + str(x)\n"
+            )
+    monkeypatch.syspath_prepend(tmpdir.strpath)
+    socket_path = os.path.join(tmpdir.strpath, "flonb.sock")
+    with flonb.server.WorkerPoolServer(socket_path, ["pipe_a", "pipe_b"]) as server:
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        client = flonb.server.Client(socket_path)
+        results = {}
+
+        def compute(name):
+            results[name] = client.compute(f"{name}:load", x=1)
+
+        threads = [
+            threading.Thread(target=compute, args=(name,))
+            for name in ["pipe_a", "pipe_b"]
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        server.shutdown()
+
+    assert results == {"pipe_a": "pipe_a1", "pipe_b": "pipe_b1"}
+    assert server.stats.nodes_deduped == 0
@@ -0,0 +1,113 @@
+import os
+import time
+
+import pytest
+
+import flonb
+import flonb.shared_memory
+from flonb.shared_memory import SharedResult, _SharedMemoryTask, _SharedResultReleaser
+
+
+@flonb.task_func()
+def make_bytes(n):
+    return bytes(n)
+
+
+@flonb.task_func()
+def total_length(parts=flonb.Dep([make_bytes.partial(n=n) for n in (10, 5000)])):
+    return sum(len(p) for p in parts)
+
+
+@flonb.task_func(cache_disk=True)
+def cached_bytes(n):
+    return bytes(n)
+
+
+def _slow_bytes(n):
+    time.sleep(0.5)
+    return bytes(n)
+
+
+def _fail():
+    raise ValueError("failed on purpose")
+
+
+def _make_adder(n):
+    return lambda x: x + n
+
+
+def _call(func, x):
+    return func(x)
+
+
+def _shm_names():
+    return set(os.listdir("/dev/shm")) if os.path.isdir("/dev/shm") else set()
+
+
+def test_shared_memory_task_shares_large_results():
+    task = _SharedMemoryTask(lambda n: bytes(n), threshold=1000, shm_name="flonb_t1")
+    assert task(10).load() == bytes(10)  # small results are passed on pickled
+
+    shared = task(5000)
+    assert isinstance(shared, SharedResult)
+    try:
+        assert shared.load() == bytes(5000)
+        # shared arguments are loaded before calling the function
+        assert _SharedMemoryTask(len, 1000, "flonb_t2")(shared).load() == 5000
+    finally:
+        shared.release()
+    shared.release()  # releasing twice is fine
+
+
+def test_shared_memory_get():
+    before = _shm_names()
+    graph, key = total_length.graph_and_key()
+    assert flonb.shared_memory.get(graph, key, num_workers=2, threshold=1000) == 5010
+
+    graph, key = make_bytes.graph_and_key(n=5000)
+    assert flonb.shared_memory.get(graph, [key], threshold=1000) == (bytes(5000),)
+    assert _shm_names() == before  # everything was released
+
+
+def test_shared_memory_get_failure_releases_everything():
+    before = _shm_names()
+    # "a" finishes after "b" has failed the run
+    dsk = {"a": (_slow_bytes, 5000), "b": (_fail,), "c": (max, "a", "b")}
+    with pytest.raises(ValueError, match="failed on purpose"):
+        flonb.shared_memory.get(dsk, "c", num_workers=2, threshold=1000)
+    assert _shm_names() == before
+
+
+def test_shared_memory_get_uses_cloudpickle():
+    # lambdas can't be pickled by the standard library, but dask uses cloudpickle
+    for threshold in (1, 1024 * 1024):
+        dsk = {"add": (_make_adder, 3), "b": (_call, "add", 1)}
+        assert flonb.shared_memory.get(dsk, "b", threshold=threshold) == 4
+        assert flonb.shared_memory.get(dsk, "add", threshold=threshold)(2) == 5
+
+
+@pytest.mark.parametrize("layout", ["flat", "packed"])
+def test_shared_memory_get_with_cache(tmpdir, layout):
+    flonb.set_cache_dir(tmpdir.strpath, layout=layout)
+    graph, key = cached_bytes.graph_and_key(n=5000)
+    assert flonb.shared_memory.get(graph, key, num_workers=2) == bytes(5000)
+    assert cached_bytes.compute(n=5000) == bytes(5000)  # cached by the worker
+
+
+def test_shared_results_released_after_last_dependent():
+    released = []
+
+    class FakeShared(SharedResult):
+        def release(self):
+            released.append(self.name)
+
+    dsk = {"a": 1, "b": (len, "a"), "c": (len, "b"), "d": (max, "b", "c")}
+    releaser = _SharedResultReleaser(dsk, ["d"])
+    releaser.posttask("a", 1, dsk, {}, 0)
+    releaser.posttask("b", FakeShared("b", 1), dsk, {}, 0)
+    releaser.posttask("c", FakeShared("c", 1), dsk, {}, 0)
+    assert released == []  # "d" still needs "b" and "c"
+    releaser.posttask("d", FakeShared("d", 1), dsk, {}, 0)
+    assert sorted(released) == ["b", "c"]  # "d" is the result, kept until loaded
+    releaser.release_all()
+    assert sorted(released) == ["b", "c", "d"]
@@ -0,0 +1,310 @@
+import http.server
+import os
+import pickle
+import sys
+import threading
+
+import pytest
+
+import flonb
+from flonb.storage import (
+    ContentAddressedStorage,
+    FileStorage,
+    HTTPObjectStoreClient,
+    ObjectStoreStorage,
+    PackedStorage,
+    ReadThroughStorage,
+    SQLiteStorage,
+)
+
+
+def test_packed_storage_small_and_large(tmpdir):
+    storage = PackedStorage(tmpdir.strpath, small_threshold=10)
+    storage.write("cat", "aa11", b"small")
+    storage.write("cat", "bb22", b"large" * 10)
+
+    assert storage.exists("cat", "aa11")
+    assert storage.exists("cat", "bb22")
+    assert not storage.exists("cat", "cc33")
+    assert storage.read("cat", "aa11") == b"small"
+    assert storage.read("cat", "bb22") == b"large" * 10
+
+    # large entries are sharded by hash prefix, small entries are packed
+    assert os.path.exists(os.path.join(tmpdir.strpath, "cat", "bb", "bb22.pickle"))
+    assert not os.path.exists(os.path.join(tmpdir.strpath, "cat", "aa"))
+    assert sorted(os.listdir(os.path.join(tmpdir.strpath, "cat", "segments"))) == [
+        "0.seg",
+        "index",
+    ]
+
+
+def test_packed_storage_overwrite_and_delete(tmpdir):
+    storage = PackedStorage(tmpdir.strpath, small_threshold=10)
+    storage.write("cat", "aa11", b"first")
+    storage.write("cat", "aa11", b"second")
+    assert storage.read("cat", "aa11") == b"second"
+
+    # small -> large -> small
+    storage.write("cat", "aa11", b"now large!")
+    assert storage.read("cat", "aa11") == b"now large!"
+    storage.write("cat", "aa11", b"small")
+    assert storage.read("cat", "aa11") == b"small"
+
+    storage.delete("cat", "aa11")
+    assert not storage.exists("cat", "aa11")
+
+
+def test_packed_storage_seen_by_other_instances(tmpdir):
+    writer = PackedStorage(tmpdir.strpath)
+    reader = PackedStorage(tmpdir.strpath)
+    assert not reader.exists("cat", "aa11")
+    writer.write("cat", "aa11", b"data")
+    assert reader.read("cat", "aa11") == b"data"
+
+
+def test_packed_storage_compact(tmpdir):
+    storage = PackedStorage(tmpdir.strpath, max_segment_size=12)
+    for i in range(10):
+        storage.write("cat", f"n{i}", b"xxxx")
+    for i in range(0, 10, 2):
+        storage.delete("cat", f"n{i}")
+    assert storage.dead_bytes("cat") == 5 * 4
+
+    storage.compact()
+    assert storage.dead_bytes("cat") == 0
+    for i in range(10):
+        assert storage.exists("cat", f"n{i}") == (i % 2 == 1)
+    assert storage.read("cat", "n3") == b"xxxx"
+
+    # other instances pick up the compacted index
+    assert PackedStorage(tmpdir.strpath).read("cat", "n9") == b"xxxx"
+
+
+def test_packed_storage_threaded_writes(tmpdir):
+    storage = PackedStorage(tmpdir.strpath)
+    errors = []
+
+    def write_and_read(i):
+        name = f"{i:06d}"
+        try:
+            for _ in range(20):
+                storage.write("c", name, b"v1")
+                storage.write("c", name, b"v2")
+                assert storage.read("c", name) == b"v2"
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=write_and_read, args=(i,)) for i in range(16)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6)  # switch threads often, to provoke races
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert errors == []
+    assert PackedStorage(tmpdir.strpath).read("c", "000003") == b"v2"
+
+
+def test_packed_cache_layout(tmpdir):
+    flonb.set_cache_dir(tmpdir.strpath, layout="packed")
+
+    _counts = [0]
+
+    @flonb.task_func(cache_disk=True)
+    def power(x, y):
+        _counts[0] += 1
+        return x**y
+
+    assert power.compute(x=2, y=3) == 8
+    assert power.compute(x=2, y=3) == 8
+    assert power.compute(x=3, y=2) == 9
+    assert _counts[0] == 2
+    assert os.path.isdir(os.path.join(tmpdir.strpath, "power", "segments"))
+
+
+def test_unknown_cache_layout(tmpdir):
+    with pytest.raises(ValueError) as excinfo:
+        flonb.set_cache_dir(tmpdir.strpath, layout="zipped")
+    assert "Unknown cache layout 'zipped'" in str(excinfo.value)
+
+
+@pytest.fixture
+def object_server():
+    """Local stand-in for an object store, keeping objects in a dict."""
+    objects = {}
+
+    class Handler(http.server.BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def _send(self, code, body=b"", length=None):
+            self.send_response(code)
+            self.send_header(
+                "Content-Length", str(len(body) if length is None else length)
+            )
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_GET(self):
+            if self.path in objects:
+                self._send(200, objects[self.path])
+            else:
+                self._send(404)
+
+        def do_HEAD(self):
+            if self.path in objects:
+                self._send(200, length=len(objects[self.path]))
+            else:
+                self._send(404)
+
+        def do_PUT(self):
+            objects[self.path] = self.rfile.read(int(self.headers["Content-Length"]))
+            self._send(200)
+
+        def do_DELETE(self):
+            objects.pop(self.path, None)
+            self._send(204)
+
+    server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_address[1]}", objects
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(
+    params=[
+        "file",
+        "packed",
+        "sqlite",
+        "object_store",
+        "read_through",
+        "content_addressed",
+    ]
+)
+def storage(request, tmpdir, object_server):
+    url, _ = object_server
+    return {
+        "file": lambda: FileStorage(tmpdir.strpath),
+        "packed": lambda: PackedStorage(tmpdir.strpath, small_threshold=8),
+        "sqlite": lambda: SQLiteStorage(os.path.join(tmpdir.strpath, "cache.sqlite")),
+        "object_store": lambda: ObjectStoreStorage(HTTPObjectStoreClient(url)),
+        "read_through": lambda: ReadThroughStorage(
+            remote=ObjectStoreStorage(HTTPObjectStoreClient(url)),
+            local=FileStorage(tmpdir.strpath),
+        ),
+        "content_addressed": lambda: ContentAddressedStorage(
+            PackedStorage(tmpdir.strpath)
+        ),
+    }[request.param]()
+
+
+def test_storage_backend(storage):
+    assert not storage.exists("cat", "aa11")
+    with pytest.raises(KeyError):
+        storage.read("cat", "aa11")
+    with pytest.raises(KeyError):
+        storage.stat("cat", "aa11")
+
+    storage.write("cat", "aa11", b"tiny")
+    storage.write("cat", "bb22", b"rather larger")
+    assert storage.exists("cat", "aa11")
+    assert storage.read("cat", "aa11") == b"tiny"
+    assert storage.read("cat", "bb22") == b"rather larger"
+    assert storage.stat("cat", "bb22").size == len(b"rather larger")
+    assert storage.exists_many("cat", ["aa11", "cc33", "bb22"]) == [True, False, True]
+    assert storage.exists_many("dog", ["aa11"]) == [False]
+
+    storage.delete("cat", "aa11")
+    assert not storage.exists("cat", "aa11")
+    storage.delete("cat", "aa11")  # deleting again is fine
+
+    # backends are shipped to worker processes
+    assert pickle.loads(pickle.dumps(storage)).read("cat", "bb22") == b"rather larger"
+
+
+def test_sqlite_exists_many_in_chunks(tmpdir):
+    storage = SQLiteStorage(os.path.join(tmpdir.strpath, "cache.sqlite"))
+    names = [f"n{i}" for i in range(1203)]
+    for name in names[::7]:
+        storage.write("cat", name, b"x")
+    assert storage.exists_many("cat", names) == [i % 7 == 0 for i in range(1203)]
+
+
+def test_read_through_fetches_once(tmpdir, object_server):
+    url, objects = object_server
+    remote = ObjectStoreStorage(HTTPObjectStoreClient(url))
+    remote.write("cat", "aa11", b"from another node")
+
+    storage = ReadThroughStorage(remote=remote, local=FileStorage(tmpdir.strpath))
+    assert storage.exists("cat", "aa11")
+    assert storage.read("cat", "aa11") == b"from another node"
+
+    objects.clear()  # remote gone, but the first read was kept locally
+    assert storage.read("cat", "aa11") == b"from another node"
+
+
+def test_cache_with_storage_backend(tmpdir):
+    flonb.set_cache_dir(
+        tmpdir.strpath,
+        storage=SQLiteStorage(os.path.join(tmpdir.strpath, "cache.sqlite")),
+    )
+
+    _counts = [0]
+
+    @flonb.task_func(cache_disk=True)
+    def power(x, y):
+        _counts[0] += 1
+        return x**y
+
+    assert power.compute(x=2, y=3) == 8
+    assert power.compute(x=2, y=3) == 8
+    assert _counts[0] == 1
+
+
+def test_cache_layout_and_storage(tmpdir):
+    with pytest.raises(ValueError) as excinfo:
+        flonb.set_cache_dir(
+            tmpdir.strpath, layout="packed", storage=FileStorage(tmpdir.strpath)
+        )
+    assert "Supply only one of `layout` and `storage`." in str(excinfo.value)
+
+
+def test_content_addressed_storage_dedups(tmpdir):
+    storage = ContentAddressedStorage(FileStorage(tmpdir.strpath))
+    storage.write("cat", "aa11", b"same")
+    storage.write("dog", "bb22", b"same")
+    storage.write("cat", "cc33", b"different")
+
+    assert storage.read("cat", "aa11") == b"same"
+    assert storage.read("dog", "bb22") == b"same"
+    assert storage.stat("dog", "bb22").size == 4
+    assert len(os.listdir(os.path.join(tmpdir.strpath, ".blobs"))) == 2
+
+    stats = storage.stats
+    assert (stats.writes, stats.bytes_written) == (3, 17)
+    assert (stats.blobs_written, stats.bytes_stored) == (2, 13)
+    assert (stats.dedup_hits, stats.bytes_saved) == (1, 4)
+    assert (stats.reads, stats.memory_hits) == (2, 1)
+
+    # the blob is kept for other entries pointing at it
+    storage.delete("cat", "aa11")
+    assert storage.read("dog", "bb22") == b"same"
+
+
+def test_content_addressed_cache(tmpdir):
+    storage = ContentAddressedStorage(FileStorage(tmpdir.strpath))
+    flonb.set_cache_dir(tmpdir.strpath, storage=storage)
+
+    @flonb.task_func(cache_disk=True)
+    def clipped(x, limit):
+        return min(x, limit)
+
+    assert [clipped.compute(x=x, limit=3) for x in range(10)] == [0, 1, 2] + [3] * 7
+    assert storage.stats.writes == 10
+    assert storage.stats.blobs_written == 4
+    assert storage.stats.dedup_hits == 6